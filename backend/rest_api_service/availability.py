@@ -0,0 +1,141 @@
+import os
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import Awaitable, Callable, Iterable
+
+import numpy as np
+from dotenv import load_dotenv
+
+
+load_dotenv()
+
+DEFAULT_SLOT_MINUTES = 15
+MAX_WINDOW = timedelta(days=366)
+# a year of 15 minute slots, smaller slots need a shorter window
+MAX_SLOTS = 366 * 24 * 4
+MAX_USERS = 100
+BUSY_CACHE_SIZE = int(os.getenv("BUSY_CACHE_SIZE", 10000))
+BUSY_CACHE_TTL_SECONDS = float(os.getenv("BUSY_CACHE_TTL_SECONDS", 60))
+# bitmaps hold one byte per slot, the entry count alone doesn't bound memory
+BUSY_CACHE_BYTES = int(os.getenv("BUSY_CACHE_BYTES", 256 * 1024 * 1024))
+
+Period = tuple[datetime, datetime]
+
+
+class BusyBitmapCache:
+    # bitmaps are keyed by the user and the exact (aligned) window, writes drop every window of the touched users
+    # per process, other workers' writes arrive through notifications, the ttl bounds staleness when they don't
+    def __init__(self, max_size: int, max_bytes: int, ttl: float):
+        self.max_size = max_size
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.bytes = 0
+        self._bitmaps: OrderedDict[tuple, tuple[float, np.ndarray]] = OrderedDict()
+        self._keys_by_user: dict[int, set[tuple]] = {}
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: tuple) -> np.ndarray | None:
+        entry = self._bitmaps.get(key)
+        if entry is None or entry[0] < time.monotonic():
+            if entry is not None:
+                self._remove(key)
+            self.misses += 1
+            return None
+        self._bitmaps.move_to_end(key)
+        self.hits += 1
+        return entry[1]
+
+    def put(self, key: tuple, bitmap: np.ndarray):
+        replaced = self._bitmaps.pop(key, None)
+        if replaced is not None:
+            self.bytes -= replaced[1].nbytes
+        self._bitmaps[key] = (time.monotonic() + self.ttl, bitmap)
+        self.bytes += bitmap.nbytes
+        self._keys_by_user.setdefault(key[0], set()).add(key)
+        while len(self._bitmaps) > self.max_size or self.bytes > self.max_bytes:
+            self._remove(next(iter(self._bitmaps)))
+
+    def invalidate(self, user_ids: Iterable[int]):
+        for user_id in user_ids:
+            for key in self._keys_by_user.pop(user_id, ()):
+                entry = self._bitmaps.pop(key, None)
+                if entry is not None:
+                    self.bytes -= entry[1].nbytes
+
+    def _remove(self, key: tuple):
+        _, bitmap = self._bitmaps.pop(key)
+        self.bytes -= bitmap.nbytes
+        self._forget(key)
+
+    def _forget(self, key: tuple):
+        keys = self._keys_by_user.get(key[0])
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self._keys_by_user[key[0]]
+
+    def stats(self) -> dict:
+        return {"size": len(self._bitmaps), "max_size": self.max_size, "bytes": self.bytes,
+                "max_bytes": self.max_bytes, "ttl_seconds": self.ttl, "hits": self.hits, "misses": self.misses}
+
+
+busy_cache = BusyBitmapCache(BUSY_CACHE_SIZE, BUSY_CACHE_BYTES, BUSY_CACHE_TTL_SECONDS)
+
+
+def align(start: datetime, slot: timedelta) -> datetime:
+    return start - (start - datetime.min) % slot
+
+
+def slot_count(start: datetime, end: datetime, slot: timedelta) -> int:
+    return -((start - end) // slot)
+
+
+def build_bitmap(periods: list[Period], start: datetime, slots: int, slot: timedelta) -> np.ndarray:
+    # +1 at the first busy slot, -1 after the last one, a cumulative sum marks everything in between
+    changes = np.zeros(slots + 1, dtype=np.int32)
+    if periods:
+        times = np.array(periods, dtype="datetime64[us]")
+        offsets = (times - np.datetime64(start, "us")) / np.timedelta64(slot)
+        first = np.clip(np.floor(offsets[:, 0]).astype(np.int64), 0, slots)
+        after_last = np.clip(np.ceil(offsets[:, 1]).astype(np.int64), 0, slots)
+        np.add.at(changes, first, 1)
+        np.add.at(changes, after_last, -1)
+    return np.cumsum(changes[:-1]) > 0
+
+
+def free_slots(bitmaps: list[np.ndarray], start: datetime, slots: int, slot: timedelta) -> list[Period]:
+    busy = np.logical_or.reduce(bitmaps) if bitmaps else np.zeros(slots, dtype=bool)
+    edges = np.flatnonzero(np.diff(np.concatenate(([False], ~busy, [False])).astype(np.int8)))
+    return [(start + slot * int(first), start + slot * int(after_last))
+            for first, after_last in zip(edges[0::2], edges[1::2])]
+
+
+def clip(periods: list[Period], start: datetime, end: datetime) -> list[Period]:
+    clipped = ((max(period_start, start), min(period_end, end)) for period_start, period_end in periods)
+    return [(period_start, period_end) for period_start, period_end in clipped if period_start < period_end]
+
+
+async def common_free_slots(
+        user_ids: Iterable[int], start: datetime, end: datetime, slot: timedelta,
+        load_periods: Callable[[list[int], datetime, datetime], Awaitable[dict[int, list[Period]]]]) -> list[Period]:
+    # bitmaps cover whole slots, so the periods are loaded for the aligned window the cache key describes
+    aligned_start = align(start, slot)
+    slots = slot_count(aligned_start, end, slot)
+    aligned_end = aligned_start + slot * slots
+    bitmaps = []
+    missing = []
+    for user_id in set(user_ids):
+        bitmap = busy_cache.get((user_id, aligned_start, slots, slot))
+        if bitmap is None:
+            missing.append(user_id)
+        else:
+            bitmaps.append(bitmap)
+    if missing:
+        periods = await load_periods(missing, aligned_start, aligned_end)
+        for user_id in missing:
+            bitmap = build_bitmap(periods.get(user_id, []), aligned_start, slots, slot)
+            busy_cache.put((user_id, aligned_start, slots, slot), bitmap)
+            bitmaps.append(bitmap)
+    return clip(free_slots(bitmaps, aligned_start, slots, slot), start, end)
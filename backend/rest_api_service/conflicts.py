@@ -0,0 +1,39 @@
+from bisect import bisect_left, bisect_right
+from datetime import datetime, timedelta
+
+import recurrence
+from recurrence import Occurrence
+
+
+# how far ahead occurrences of the written event are checked
+CONFLICT_LOOKAHEAD = timedelta(days=90)
+
+
+class IntervalIndex:
+    # occurrences sorted by start, an overlap can only start between (start - longest duration) and end
+    def __init__(self, occurrences: list[Occurrence]):
+        self._occurrences = sorted(occurrences, key=lambda occurrence: occurrence.event_date_start)
+        self._starts = [occurrence.event_date_start for occurrence in self._occurrences]
+        self._longest = max((occurrence.event_date_end - occurrence.event_date_start
+                             for occurrence in self._occurrences), default=timedelta(0))
+
+    def overlapping(self, start: datetime, end: datetime) -> list[Occurrence]:
+        # strict, an event ending exactly when the next one starts is not a conflict
+        first = bisect_right(self._starts, start - self._longest)
+        last = bisect_left(self._starts, end)
+        return [occurrence for occurrence in self._occurrences[first:last] if occurrence.event_date_end > start]
+
+
+def conflict_window(event) -> tuple[datetime, datetime]:
+    start = max(event.event_date_start, datetime.now()) if recurrence.is_recurring(event) else event.event_date_start
+    return start, start + CONFLICT_LOOKAHEAD
+
+
+def find_conflicts(event, existing: list[Occurrence], start: datetime, end: datetime) -> list[Occurrence]:
+    index = IntervalIndex([occurrence for occurrence in existing if occurrence.event_id != event.event_id])
+    conflicts = {}
+    for occurrence_index in recurrence.iter_occurrence_indexes(event, start, end):
+        planned = recurrence.occurrence(event, occurrence_index)
+        for occurrence in index.overlapping(planned.event_date_start, planned.event_date_end):
+            conflicts[(occurrence.event_id, occurrence.event_date_start)] = occurrence
+    return sorted(conflicts.values(), key=lambda occurrence: occurrence.event_date_start)
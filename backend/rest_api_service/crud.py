@@ -1,60 +1,165 @@
-from typing import Type
+from collections import Counter
+from typing import Iterable, Type
 
+import availability
+import conflicts
+import importer
 import models
+import notifications
+import occurrences
+import pagination
+import recurrence
+import suggestions
 from models import DBUser, DBUserFriendship
 from datetime import date, datetime
 
 
-from sqlalchemy.orm import Session, aliased
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import aliased, joinedload, selectinload
 from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm.exc import NoResultFound
-from sqlalchemy import and_
+from sqlalchemy import Boolean, Integer, and_, any_, delete, func, insert, literal, or_, select, true, tuple_, union, update
+from sqlalchemy.dialects.postgresql import ARRAY, insert as pg_insert
+from friend_graph import friend_graph
+from last_login import last_login_buffer
 from schemas import Friendship
+from user_cache import user_cache
 from typing import Union
 
 
+# relationships serialized by schemas.EventSchema, loaded up front in a fixed number of queries
+EVENT_DETAILS = (
+    joinedload(models.DBEvent.creator),
+    selectinload(models.DBEvent.categories),
+    selectinload(models.DBEvent.participants),
+)
+
+
+def keyset(statement, columns, after: tuple | None = None, limit: int | None = None):
+    # pages are ordered by a unique key, the next page starts right after the last key seen
+    statement = statement.order_by(*columns)
+    if after is not None:
+        statement = statement.where(tuple_(*columns) > tuple_(*after))
+    if limit is not None:
+        statement = statement.limit(limit)
+    return statement
+
+
+async def stream_scalars(db: AsyncSession, statement):
+    # server-side cursor, only STREAM_BATCH_SIZE rows are held in memory at a time
+    result = await db.stream_scalars(statement.execution_options(yield_per=pagination.STREAM_BATCH_SIZE))
+    async for row in result:
+        yield row
+
  
-async def get_user_by_id(db: Session, user_id: int) -> models.DBUser | None:
-    user = db.query(models.DBUser).filter(models.DBUser.user_id == user_id).first()
+async def get_user_by_id(db: AsyncSession, user_id: int) -> models.DBUser | None:
+    user = (await db.execute(select(models.DBUser).where(models.DBUser.user_id == user_id))).scalars().first()
     return user
 
-async def get_user_by_username(db: Session, username: str) -> models.DBUser | None:
-    user = db.query(models.DBUser).filter(models.DBUser.username == username).first()
+async def get_user_by_username(db: AsyncSession, username: str) -> models.DBUser | None:
+    user = (await db.execute(select(models.DBUser).where(models.DBUser.username == username))).scalars().first()
     return user
 
-async def get_all_events_by_user_id(db: Session, user_id: int) -> models.DBUser | None:
-    user = db.query(models.DBEvent).filter(models.DBEvent.created_by == user_id).first()
+async def get_all_events_by_user_id(db: AsyncSession, user_id: int) -> models.DBUser | None:
+    user = (await db.execute(select(models.DBEvent).where(models.DBEvent.created_by == user_id))).scalars().first()
     return user
 
-async def get_all_friends_of_user_by_user_id(db: Session, user_id: int):
+async def get_user_version(db: AsyncSession, user_id: int) -> int | None:
+    return (await db.execute(select(models.DBUser.version).where(
+        models.DBUser.user_id == user_id))).scalar_one_or_none()
 
-    user_alias = aliased(DBUser)
 
-    friends1 = db.query(user_alias).join(
-        DBUserFriendship,
-        DBUserFriendship.user1_id == user_id
-    ).filter(
-        DBUserFriendship.user2_id == user_alias.user_id,
-        user_alias.is_active == True
-    )
+async def get_friends_version(db: AsyncSession, user_id: int) -> tuple | None:
+    # the friend ids plus the row versions of the active ones, one aggregate over primary key lookups
+    if not friend_graph.loaded:
+        return None
+    friend_ids = friend_graph.friends_of(user_id)
+    count, versions = (await db.execute(select(func.count(), func.coalesce(func.sum(models.DBUser.version), 0)).where(
+        user_id_in(friend_ids), models.DBUser.is_active == True))).one()
+    return tuple(sorted(friend_ids)), count, versions
 
-    friends2 = db.query(user_alias).join(
-        DBUserFriendship,
-        DBUserFriendship.user2_id == user_id
-    ).filter(
-        DBUserFriendship.user1_id == user_alias.user_id,
-        user_alias.is_active == True
-    )
 
-    active_friends = friends1.union(friends2).all()
+async def get_all_friends_of_user_by_user_id(db: AsyncSession, user_id: int):
+    if friend_graph.loaded:
+        friend_ids = friend_graph.friends_of(user_id)
+        if not friend_ids:
+            return []
+        # the graph only knows friendships, whether the friend is still active is a primary key lookup
+        return (await db.execute(active_users_query().where(
+            user_id_in(friend_ids)).order_by(models.DBUser.user_id))).scalars().all()
+
+    friend_alias = aliased(DBUser, friend_ids_query(user_id).subquery())
+    friends = select(DBUser).join(friend_alias, friend_alias.user_id == DBUser.user_id)
+    active_friends = (await db.execute(friends.order_by(DBUser.user_id))).scalars().all()
 
     return active_friends
 
-async def get_all_active_users(db: Session) -> models.DBUser | None:
-    user = db.query(models.DBUser).filter(models.DBUser.is_active == True).all()
+def user_id_in(user_ids: Iterable[int]):
+    # ids from friend_graph have no upper bound, one array parameter instead of a bind parameter per id
+    return models.DBUser.user_id == any_(literal(list(user_ids), ARRAY(Integer)))
+
+
+def friend_ids_query(user_id: int):
+    # fallback for when friend_graph isn't loaded yet, same accepted friendships of active users
+    friends1 = select(DBUserFriendship.user2_id.label("user_id")).join(
+        DBUser, DBUser.user_id == DBUserFriendship.user2_id
+    ).where(DBUserFriendship.user1_id == user_id, DBUserFriendship.friendship_status == "accepted",
+            DBUser.is_active == True)
+
+    friends2 = select(DBUserFriendship.user1_id.label("user_id")).join(
+        DBUser, DBUser.user_id == DBUserFriendship.user1_id
+    ).where(DBUserFriendship.user2_id == user_id, DBUserFriendship.friendship_status == "accepted",
+            DBUser.is_active == True)
+
+    return union(friends1, friends2)
+
+
+async def get_shared_event_counts(db: AsyncSession, user_id: int) -> Counter:
+    # how many events every co-participant shares with user_id, read through a per-event LIMIT so large public
+    # events cost at most MAX_PARTICIPANTS_PER_SHARED_EVENT rows each
+    participants = models.DBEventParticipants
+    other = aliased(models.DBEventParticipants)
+    mine = (select(participants.event_id).where(participants.user_id == user_id)
+            .order_by(participants.event_id.desc()).limit(suggestions.MAX_SHARED_EVENTS).subquery())
+    co_participants = (select(other.user_id).where(other.event_id == mine.c.event_id, other.user_id != user_id)
+                       .limit(suggestions.MAX_PARTICIPANTS_PER_SHARED_EVENT).lateral())
+    rows = (await db.execute(
+        select(co_participants.c.user_id, func.count())
+        .select_from(mine.join(co_participants, true()))
+        .group_by(co_participants.c.user_id))).all()
+    return Counter(dict(rows))
+
+
+async def get_friend_suggestions(db: AsyncSession, user_id: int, limit: int) -> list[dict] | None:
+    if not friend_graph.loaded:
+        return None
+    mutual_friends = friend_graph.mutual_friend_counts(user_id, suggestions.MAX_TWO_HOP_EDGES)
+    shared_events = await get_shared_event_counts(db, user_id)
+    friend_ids = friend_graph.friends_of(user_id)
+    for friend_id in friend_ids:
+        shared_events.pop(friend_id, None)
+    # a few extra candidates make up for inactive users dropped below
+    ranked = suggestions.rank(mutual_friends, shared_events, limit * 2)
+    active = {user.user_id: user for user in (await db.execute(active_users_query().where(
+        user_id_in(candidate for candidate, _, _ in ranked)))).scalars().all()}
+    return [{"user": active[candidate], "mutual_friends": mutual, "shared_events": shared}
+            for candidate, mutual, shared in ranked if candidate in active][:limit]
+
+
+def active_users_query():
+    return select(models.DBUser).where(models.DBUser.is_active == True)
+
+
+async def get_all_active_users(db: AsyncSession, after: tuple | None = None,
+                               limit: int | None = None) -> list[models.DBUser]:
+    user = (await db.execute(keyset(active_users_query(), [models.DBUser.user_id], after, limit))).scalars().all()
     return user
 
-async def create_user(db: Session, username: str, email: str, password_hash: str, birthday: date, is_active: bool = True):
+
+def stream_all_active_users(db: AsyncSession):
+    return stream_scalars(db, keyset(active_users_query(), [models.DBUser.user_id]))
+
+async def create_user(db: AsyncSession, username: str, email: str, password_hash: str, birthday: date, is_active: bool = True):
     new_user = DBUser(
         username=username,
         email=email,
@@ -66,90 +171,95 @@ async def create_user(db: Session, username: str, email: str, password_hash: str
         is_active=is_active
     )
     db.add(new_user)
-    db.commit()
-    db.refresh(new_user)
+    await db.commit()
+    await db.refresh(new_user)
     return new_user
 
 
-async def update_user_birthday(db: Session, user_id: int, new_birthday: date):
-    user = db.query(DBUser).filter(DBUser.user_id == user_id).first()
+async def update_user_birthday(db: AsyncSession, user_id: int, new_birthday: date):
+    user = (await db.execute(select(DBUser).where(DBUser.user_id == user_id))).scalars().first()
     if user:
         user.birthday = new_birthday
         user.update_date = date.today()
-        db.commit()
-        db.refresh(user)
+        await db.commit()
+        await db.refresh(user)
+        user_cache.invalidate(user.user_id)
         return user
     else:
         return None
 
-async def change_user_password(db: Session, user_id: int, new_password_hash: str):
-    user = db.query(DBUser).filter(DBUser.user_id == user_id).first()
+async def change_user_password(db: AsyncSession, user_id: int, new_password_hash: str):
+    user = (await db.execute(select(DBUser).where(DBUser.user_id == user_id))).scalars().first()
     if user:
         user.password_hash = new_password_hash
         user.update_date = date.today()
-        db.commit()
-        db.refresh(user)
+        await db.commit()
+        await db.refresh(user)
+        user_cache.invalidate(user.user_id)
         return user
     else:
         return None
     
-async def change_user_email(db: Session, user_id: int, new_email: str):
-    user = db.query(DBUser).filter(DBUser.user_id == user_id).first()
+async def change_user_email(db: AsyncSession, user_id: int, new_email: str):
+    user = (await db.execute(select(DBUser).where(DBUser.user_id == user_id))).scalars().first()
     if user:
         user.email = new_email
         user.update_date = date.today()
-        db.commit()
-        db.refresh(user)
+        await db.commit()
+        await db.refresh(user)
+        user_cache.invalidate(user.user_id)
         return user
     else:
         return None
     
-async def change_user_username(db: Session, user_id: int, new_username: str):
-    user = db.query(DBUser).filter(DBUser.user_id == user_id).first()
+async def change_user_username(db: AsyncSession, user_id: int, new_username: str):
+    user = (await db.execute(select(DBUser).where(DBUser.user_id == user_id))).scalars().first()
     if user:
         user.username = new_username
         user.update_date = date.today()
-        db.commit()
-        db.refresh(user)
+        # events render their creator's username
+        await log_changes_of_events(select(models.DBEvent.event_id).where(models.DBEvent.created_by == user_id), db=db)
+        await db.commit()
+        await db.refresh(user)
+        user_cache.invalidate(user.user_id)
         return user
     else:
         return None
        
 
-async def update_user_last_login(db: Session, user_id: int):
-    user = db.query(DBUser).filter(DBUser.user_id == user_id).first()
-    if user:
-        now = datetime.now().replace(microsecond=0)
-        user.last_login = now
-        user.update_date = now
-        db.commit()
-        db.refresh(user)
-        return user
-    else:
-        return None
-
-
-async def get_all_categories(db: Session) -> list[Type[models.DBCategory]] | None:
-    categories = db.query(models.DBCategory).all()
+async def get_all_categories(db: AsyncSession, after: tuple | None = None,
+                             limit: int | None = None) -> list[Type[models.DBCategory]] | None:
+    categories = (await db.execute(
+        keyset(select(models.DBCategory), [models.DBCategory.category_id], after, limit))).scalars().all()
 
     return categories
 
 
-async def get_all_events(db: Session) -> list[Type[models.DBEvent]] | None:
-    events = db.query(models.DBEvent).all()
+async def get_all_events(db: AsyncSession, after: tuple | None = None,
+                         limit: int | None = None) -> list[Type[models.DBEvent]] | None:
+    events = (await db.execute(keyset(select(models.DBEvent), [models.DBEvent.event_id], after, limit))).scalars().all()
 
     return events
 
 
-async def get_all_participants(db: Session) -> list[Type[models.DBEventParticipants]] | None:
-    participants = db.query(models.DBEventParticipants).all()
+PARTICIPANT_KEY = [models.DBEventParticipants.event_id, models.DBEventParticipants.user_id]
+
+
+async def get_all_participants(db: AsyncSession, after: tuple | None = None,
+                               limit: int | None = None) -> list[Type[models.DBEventParticipants]] | None:
+    participants = (await db.execute(
+        keyset(select(models.DBEventParticipants), PARTICIPANT_KEY, after, limit))).scalars().all()
 
     return participants
 
 
-async def get_user_by_id(db: Session, user_id: int) -> Type[models.DBUser] | None:
+def stream_all_participants(db: AsyncSession):
+    return stream_scalars(db, keyset(select(models.DBEventParticipants), PARTICIPANT_KEY))
+
+
+async def get_user_by_id(db: AsyncSession, user_id: int) -> Type[models.DBUser] | None:
     try:
-        user = db.query(models.DBUser).filter(models.DBUser.user_id == user_id).first()
+        user = (await db.execute(select(models.DBUser).where(models.DBUser.user_id == user_id))).scalars().first()
         return user
     except NoResultFound:
         return None
@@ -157,9 +267,9 @@ async def get_user_by_id(db: Session, user_id: int) -> Type[models.DBUser] | Non
         return None
 
 
-async def get_user_by_username(db: Session, username: str) -> Type[models.DBUser] | None:
+async def get_user_by_username(db: AsyncSession, username: str) -> Type[models.DBUser] | None:
     try:
-        user = db.query(models.DBUser).filter(models.DBUser.username == username).first()
+        user = (await db.execute(select(models.DBUser).where(models.DBUser.username == username))).scalars().first()
         return user
     except NoResultFound:
         return None
@@ -167,7 +277,7 @@ async def get_user_by_username(db: Session, username: str) -> Type[models.DBUser
         return None
 
 
-async def create_user(db: Session, username: str, email: str, password_hash: str,
+async def create_user(db: AsyncSession, username: str, email: str, password_hash: str,
                       birthday: datetime) -> models.DBUser | None:
     try:
         user = models.DBUser(
@@ -181,222 +291,524 @@ async def create_user(db: Session, username: str, email: str, password_hash: str
             is_active=True
         )
         db.add(user)
-        db.commit()
-        db.refresh(user)
+        await db.commit()
+        await db.refresh(user)
         return user
     except Exception:
-        db.rollback()
+        await db.rollback()
         return None
 
 
-async def update_user_last_login(db: Session, id: int) -> None:
-    try:
-        user = await get_user_by_id(db, id)
-        if user:
-            user.last_login = datetime.now()
-            db.commit()
-            db.refresh(user)
-    except Exception:
-        db.rollback()
-        return None
-    
+def update_user_last_login(id: int) -> datetime:
+    # written behind by last_login.run_flush_job, the login itself doesn't wait for a transaction
+    logged_in_at = datetime.now()
+    last_login_buffer.record(id, logged_in_at)
+    return logged_in_at
+
 
-async def change_password(db: Session, id: int, password_hash : str):
+async def change_password(db: AsyncSession, id: int, password_hash : str):
     try:
         user = await get_user_by_id(db, id)
         if user:
             user.password_hash = password_hash;
             user.update_date = date.today()
-            db.commit()
-            db.refresh(user)
+            await db.commit()
+            await db.refresh(user)
+            user_cache.invalidate(user.user_id)
             return user
     except Exception:
-        db.rollback()
+        await db.rollback()
         return None
 
 
-async def get_event_by_id(event_id: int, db: Session):
-    return db.get(models.DBEvent, event_id)
+async def get_event_by_id(event_id: int, db: AsyncSession):
+    return await db.get(models.DBEvent, event_id, options=EVENT_DETAILS)
 
 
-async def get_all_events_of_user_by_user_id(user_id: int, db: Session):
-    return db.query(models.DBEvent).join(models.DBEventParticipants).filter(
-        models.DBEventParticipants.user_id == user_id).all()
+def events_of_user_query(user_id: int):
+    return select(models.DBEvent).join(models.DBEventParticipants).where(
+        models.DBEventParticipants.user_id == user_id).options(*EVENT_DETAILS)
 
 
-async def get_all_events_by_creator_id(user_id: int, db: Session):
-    return db.query(models.DBEvent).filter(
-        models.DBEvent.created_by == user_id).all()
+async def get_all_events_of_user_by_user_id(user_id: int, db: AsyncSession, after: tuple | None = None,
+                                            limit: int | None = None):
+    return (await db.execute(
+        keyset(events_of_user_query(user_id), [models.DBEvent.event_id], after, limit))).scalars().all()
 
 
-async def get_all_event_participants(event_id: int, db: Session):
-    return db.query(models.DBUser).join(models.DBEventParticipants).filter(
-        models.DBEventParticipants.event_id == event_id).all()
+def stream_all_events_of_user_by_user_id(user_id: int, db: AsyncSession):
+    return stream_scalars(db, keyset(events_of_user_query(user_id), [models.DBEvent.event_id]))
 
 
-async def get_all_events_by_user_id_ongoing_in_specified_time(user_id: int, start: datetime,
-                                                              end: datetime, db: Session):
-    events = []
-    for event in await get_all_events_of_user_by_user_id(user_id=user_id, db=db):
-        while event is not None and event.event_date_start <= end:
-            if event.event_date_end >= start:
-                events += [event]
-            event = event.next_event()
-    return events
+def stream_events_of_user_for_export(user_id: int, start: datetime | None, end: datetime | None, db: AsyncSession):
+    # a series is exported whole as an RRULE, so any series starting before end reaches into the window
+    statement = select(models.DBEvent).join(models.DBEventParticipants).where(
+        models.DBEventParticipants.user_id == user_id).options(selectinload(models.DBEvent.categories))
+    if end is not None:
+        statement = statement.where(models.DBEvent.event_date_start < end)
+    if start is not None:
+        statement = statement.where(or_(
+            models.DBEvent.recurrence.in_([*recurrence.FIXED_STEPS, *recurrence.MONTH_STEPS]),
+            models.DBEvent.event_date_end > start))
+    return stream_scalars(db, keyset(statement, [models.DBEvent.event_id]))
+
+
+async def get_all_events_by_creator_id(user_id: int, db: AsyncSession):
+    return (await db.execute(select(models.DBEvent).where(
+        models.DBEvent.created_by == user_id).options(*EVENT_DETAILS))).scalars().all()
 
 
-async def create_required_event_participants(db_event, db):
-    participants = [db_event.created_by]
+async def get_all_event_participants(event_id: int, db: AsyncSession):
+    return (await db.execute(select(models.DBUser).join(models.DBEventParticipants).where(
+        models.DBEventParticipants.event_id == event_id))).scalars().all()
+
+
+async def get_all_events_by_user_id_ongoing_in_specified_time(user_id: int, start: datetime,
+                                                              end: datetime, db: AsyncSession):
+    if not occurrences.covers(start, end):
+        # every series that started before the window ends may have an occurrence in it
+        events = (await db.execute(select(models.DBEvent).join(models.DBEventParticipants).where(
+            models.DBEventParticipants.user_id == user_id,
+            models.DBEvent.event_date_start <= end))).scalars().all()
+        return list(recurrence.expand(events, start=start, end=end))
+    rows = (await db.execute(
+        select(models.DBEvent, models.DBEventOccurrence.occurrence_index)
+        .join(models.DBEventOccurrence, models.DBEventOccurrence.event_id == models.DBEvent.event_id)
+        .join(models.DBEventParticipants, models.DBEventParticipants.event_id == models.DBEvent.event_id)
+        .where(models.DBEventParticipants.user_id == user_id, occurrences.overlapping(start, end))
+        .order_by(models.DBEventOccurrence.occurrence_start))).all()
+    return [recurrence.occurrence(event, index) for event, index in rows]
+
+
+async def get_busy_periods_of_users(user_ids: list[int], start: datetime, end: datetime,
+                                    db: AsyncSession) -> dict[int, list[availability.Period]]:
+    periods = {user_id: [] for user_id in user_ids}
+    if not occurrences.covers(start, end):
+        rows = (await db.execute(
+            select(models.DBEventParticipants.user_id, models.DBEvent)
+            .join(models.DBEvent, models.DBEvent.event_id == models.DBEventParticipants.event_id)
+            .where(models.DBEventParticipants.user_id.in_(user_ids), models.DBEvent.event_date_start <= end))).all()
+        for user_id, event in rows:
+            periods[user_id].extend((occurrence.event_date_start, occurrence.event_date_end)
+                                    for occurrence in recurrence.expand([event], start=start, end=end))
+        return periods
+    rows = (await db.execute(
+        select(models.DBEventParticipants.user_id, models.DBEventOccurrence.occurrence_start,
+               models.DBEventOccurrence.occurrence_end)
+        .join(models.DBEventOccurrence, models.DBEventOccurrence.event_id == models.DBEventParticipants.event_id)
+        .where(models.DBEventParticipants.user_id.in_(user_ids), occurrences.overlapping(start, end)))).all()
+    for user_id, occurrence_start, occurrence_end in rows:
+        periods[user_id].append((occurrence_start, occurrence_end))
+    return periods
+
+
+async def get_event_conflicts(event, db: AsyncSession) -> list[recurrence.Occurrence]:
+    # only the creator's occurrences inside the lookahead window are loaded, through the occurrence index
+    start, end = conflicts.conflict_window(event)
+    existing = await get_all_events_by_user_id_ongoing_in_specified_time(user_id=event.created_by, start=start,
+                                                                         end=end, db=db)
+    return conflicts.find_conflicts(event, existing, start, end)
+
+
+async def get_event_participant_ids(event_id: int, db: AsyncSession) -> list[int]:
+    return (await db.execute(select(models.DBEventParticipants.user_id).where(
+        models.DBEventParticipants.event_id == event_id))).scalars().all()
+
+
+async def log_event_changes(event_id: int, changed_user_ids, removed_user_ids, db: AsyncSession):
+    # written in the transaction of the change itself, so a sync never sees a change that was rolled back
+    # two array parameters unnested in SQL, a row of bind parameters per user hits asyncpg's 32767 limit
+    user_ids = [*set(changed_user_ids), *set(removed_user_ids)]
+    if user_ids:
+        deleted = [False] * len(set(changed_user_ids)) + [True] * len(set(removed_user_ids))
+        rows = func.unnest(literal(user_ids, ARRAY(Integer)), literal(deleted, ARRAY(Boolean))).table_valued(
+            "user_id", "deleted")
+        await db.execute(insert(models.DBEventChange).from_select(
+            ["user_id", "event_id", "deleted"], select(rows.c.user_id, literal(event_id), rows.c.deleted)))
+    # connected clients are only told what changed, they fetch it through /events/sync
+    if changed_user_ids:
+        await notifications.notify(changed_user_ids, {"type": "event_changed", "event_id": event_id}, db=db)
+    if removed_user_ids:
+        await notifications.notify(removed_user_ids, {"type": "event_removed", "event_id": event_id}, db=db)
+
+
+async def log_changes_of_events(event_ids, db: AsyncSession):
+    # for writes outside db_event that change how events render, one INSERT ... SELECT over their participants
+    participants = models.DBEventParticipants
+    user_ids = (await db.execute(
+        insert(models.DBEventChange)
+        .from_select(["user_id", "event_id", "deleted"],
+                     select(participants.user_id, participants.event_id, literal(False))
+                     .where(participants.event_id.in_(event_ids)))
+        .returning(models.DBEventChange.user_id))).scalars().all()
+    await notifications.notify(user_ids, {"type": "events_changed"}, db=db)
+
+
+async def get_event_version(event_id: int, db: AsyncSession) -> int | None:
+    # None for events not touched since the change log exists, those are always sent in full
+    return (await db.execute(select(func.max(models.DBEventChange.change_id)).where(
+        models.DBEventChange.event_id == event_id))).scalar_one()
+
+
+async def get_events_of_user_version(user_id: int, db: AsyncSession) -> int | None:
+    return (await db.execute(select(func.max(models.DBEventChange.change_id)).where(
+        models.DBEventChange.user_id == user_id))).scalar_one()
+
+
+async def get_latest_change_id(db: AsyncSession) -> int:
+    return (await db.execute(select(func.coalesce(func.max(models.DBEventChange.change_id), 0)))).scalar_one()
+
+
+async def get_event_changes_of_user(user_id: int, cursor: int, limit: int, db: AsyncSession) -> dict:
+    changes = (await db.execute(
+        select(models.DBEventChange.change_id, models.DBEventChange.event_id, models.DBEventChange.deleted)
+        .where(models.DBEventChange.user_id == user_id, models.DBEventChange.change_id > cursor)
+        .order_by(models.DBEventChange.change_id).limit(limit))).all()
+    # only the last change of every event in the page matters
+    deleted = {event_id: is_deleted for _, event_id, is_deleted in changes}
+    changed_ids = [event_id for event_id, is_deleted in deleted.items() if not is_deleted]
+    events = []
+    if changed_ids:
+        events = (await db.execute(events_of_user_query(user_id).where(
+            models.DBEvent.event_id.in_(changed_ids)).order_by(models.DBEvent.event_id))).scalars().all()
+    # an event changed in this page but gone by now has its tombstone in a later page, report it right away
+    loaded_ids = {event.event_id for event in events}
+    return {
+        "cursor": changes[-1].change_id if changes else cursor,
+        "has_more": len(changes) == limit,
+        "events": events,
+        "deleted": sorted(event_id for event_id in deleted if event_id not in loaded_ids),
+    }
+
+
+async def create_required_event_participants(db_event, db) -> list[int]:
+    response_time = datetime.now()  # TODO: zgadnij kiedy odpowie
+    await db.execute(insert(models.DBEventParticipants).values(
+        event_id=db_event.event_id, user_id=db_event.created_by, participant_status="accepted",
+        participant_role="host", response_time=response_time))
+    participant_ids = [db_event.created_by]
     if db_event.privacy == "public":
-        participants.extend(await get_all_friends_of_user_by_user_id(db=db, user_id=db_event.created_by))
-    for participant in participants:
-        db.add(models.DBEventParticipants(event_id=db_event.event_id, user_id=participant,
-                                          participant_status="accepted" if participant == db_event.created_by
-                                          else "pending",
-                                          participant_role="host" if participant == db_event.created_by else "member",
-                                          response_time=datetime.now()))  # TODO: zgadnij kiedy odpowie
+        # one INSERT ... SELECT, only the inserted ids come back
+        if friend_graph.loaded:
+            friends = select(models.DBUser.user_id).where(
+                user_id_in(friend_graph.friends_of(db_event.created_by)),
+                models.DBUser.is_active == True).subquery()
+        else:
+            friends = friend_ids_query(db_event.created_by).subquery()
+        inserted = await db.execute(pg_insert(models.DBEventParticipants).from_select(
+            ["event_id", "user_id", "participant_status", "participant_role", "response_time"],
+            select(literal(db_event.event_id), friends.c.user_id, literal("pending", models.status),
+                   literal("member", models.event_role), literal(response_time, models.TIMESTAMP))
+            .where(friends.c.user_id != db_event.created_by)
+        ).on_conflict_do_nothing().returning(models.DBEventParticipants.user_id))
+        participant_ids.extend(inserted.scalars().all())
+    return participant_ids
 
 
-async def create_event_categories(event_id: int, event: models.EventRequest, db: Session):
-    for category_id in event.categories:
-        db.add(models.DBEventCategory(event_id=event_id, category_id=category_id))
+async def create_event_categories(event_id: int, event: models.EventRequest, db: AsyncSession):
+    if event.categories:
+        await db.execute(insert(models.DBEventCategory),
+                         [{"event_id": event_id, "category_id": category_id} for category_id in event.categories])
 
 
-async def create_event_with_required_associations(event: models.EventRequest, db: Session):
+async def create_event_with_required_associations(event: models.EventRequest, db: AsyncSession):
     db_event = models.DBEvent.create(event)
     db.add(db_event)
-    db.commit()
-    await create_required_event_participants(db_event=db_event, db=db)
+    # flush only to get event_id, everything below is committed together
+    await db.flush()
+    participant_ids = await create_required_event_participants(db_event=db_event, db=db)
     await create_event_categories(event_id=db_event.event_id, event=event, db=db)
-    db.commit()
+    await occurrences.materialize_event(db_event, db=db)
+    await log_event_changes(db_event.event_id, participant_ids, [], db=db)
+    await db.commit()
+    availability.busy_cache.invalidate(participant_ids)
+    return db_event
 
 
-async def create_event_participant(event_participants: str, db: Session):
+async def create_event_participant(event_participants: str, db: AsyncSession):
     # TODO: consider is it useless and potentially remove (depends on future)
     db_event_participants = models.DBEventParticipants.create(event_participants)
     db.add(db_event_participants)
-    db.commit()
+    # sessions don't autoflush, the new row has to be written before the participant ids are read
+    await db.flush()
+    # the others see the participant list of the event change
+    await log_event_changes(db_event_participants.event_id,
+                            await get_event_participant_ids(event_id=db_event_participants.event_id, db=db), [], db=db)
+    await db.commit()
+    availability.busy_cache.invalidate([db_event_participants.user_id])
 
 
-async def create_category(category: models.CategoryRequest, db: Session):
+async def create_category(category: models.CategoryRequest, db: AsyncSession):
     db_category = models.DBCategory.create(category)
     db.add(db_category)
-    db.commit()
+    await db.commit()
 
 
-async def update_event(event_id: int, changed_data: models.EventRequest, db: Session):
-    event = db.get(models.DBEvent, event_id)
+async def update_event(event_id: int, changed_data: models.EventRequest, db: AsyncSession):
+    event = await db.get(models.DBEvent, event_id)
     new_data = changed_data.dict(exclude_unset=True)
+    privacy_changed = "privacy" in new_data and not event.privacy == new_data["privacy"]
     for field, value in new_data.items():
         if field == "categories":
             await delete_all_event_categories(event_id=event_id, db=db)
             await create_event_categories(event_id=event_id, event=changed_data, db=db)
         else:
-            if field == "privacy" and not event.privacy == value:
-                await delete_all_event_participants(event_id=event_id, db=db)
-                setattr(event, field, value)
-                db.commit()
-                await create_required_event_participants(db_event=event, db=db)
-            else:
-                setattr(event, field, value)
-    db.commit()
-
-
-async def update_category(category_id: int, changed_data: models.CategoryRequest, db: Session):
-    category = db.get(models.DBCategory, category_id)
+            setattr(event, field, value)
+    times_changed = bool(new_data.keys() & {"event_date_start", "event_date_end", "recurrence"})
+    if times_changed:
+        await occurrences.rematerialize_event(event, db=db)
+    removed_user_ids = set()
+    if privacy_changed:
+        removed_user_ids.update(await delete_all_event_participants(event_id=event_id, db=db))
+        await create_required_event_participants(db_event=event, db=db)
+    # every participant sees the updated event, the ones dropped by a privacy change get a tombstone
+    participant_ids = await get_event_participant_ids(event_id=event_id, db=db)
+    removed_user_ids.difference_update(participant_ids)
+    await log_event_changes(event_id, participant_ids, removed_user_ids, db=db)
+    await db.commit()
+    if times_changed or privacy_changed:
+        availability.busy_cache.invalidate([*participant_ids, *removed_user_ids])
+    return event
+
+
+async def update_category(category_id: int, changed_data: models.CategoryRequest, db: AsyncSession):
+    category = await db.get(models.DBCategory, category_id)
     new_data = changed_data.dict(exclude_unset=True)
     for field, value in new_data.items():
         setattr(category, field, value)
-    db.commit()
+    # events render the name and description of their categories
+    await log_changes_of_events(select(models.DBEventCategory.event_id).where(
+        models.DBEventCategory.category_id == category_id), db=db)
+    await db.commit()
 
 
-async def delete_event_and_associated_objects(user_id: int, event_id: int, db: Session):
-    event = db.get(models.DBEvent, event_id)
+async def delete_event_and_associated_objects(user_id: int, event_id: int, db: AsyncSession):
+    event = await db.get(models.DBEvent, event_id)
     if event.created_by == user_id:
         await delete_all_event_categories(event_id=event_id, db=db)
-        await delete_all_event_participants(event_id=event_id, db=db)
-        db.delete(event)
-        db.commit()
+        participant_ids = await delete_all_event_participants(event_id=event_id, db=db)
+        await occurrences.clear_event(event_id, db=db)
+        await db.execute(delete(models.DBEvent).where(models.DBEvent.event_id == event_id))
+        await log_event_changes(event_id, [], participant_ids, db=db)
+        await db.commit()
+        availability.busy_cache.invalidate(participant_ids)
     else:
         await accept_or_reject_participate_in_event(user_id=user_id, event_id=event_id, is_accepted=False, db=db)
 
 
-async def accept_or_reject_participate_in_event(user_id: int, event_id: int, is_accepted: bool, db: Session):
-    db_event_participant = db.query(models.DBEventParticipants).filter(
-        models.DBEventParticipants.event_id == event_id and models.DBEventParticipants.user_id == user_id).first()
+async def accept_or_reject_participate_in_event(user_id: int, event_id: int, is_accepted: bool, db: AsyncSession):
+    participant = and_(models.DBEventParticipants.event_id == event_id, models.DBEventParticipants.user_id == user_id)
     if is_accepted:
-        db_event_participant.participant_status = "accepted"
-        db_event_participant.response_time = datetime.now()
+        await db.execute(update(models.DBEventParticipants).where(participant).values(
+            participant_status="accepted", response_time=datetime.now()))
+        removed_user_ids = []
     else:
-        db.delete(db_event_participant)
-    db.commit()
+        await db.execute(delete(models.DBEventParticipants).where(participant))
+        removed_user_ids = [user_id]
+    # the others see the participant list of the event change
+    await log_event_changes(event_id, await get_event_participant_ids(event_id=event_id, db=db), removed_user_ids,
+                            db=db)
+    await db.commit()
+    availability.busy_cache.invalidate([user_id])
 
 
 
-async def delete_all_event_participants(event_id: int, db: Session):
-    db_event_participants = db.query(models.DBEventParticipants).filter(
-        models.DBEventParticipants.event_id == event_id).all()
-    for db_event_participant in db_event_participants:
-        db.delete(db_event_participant)
-    db.commit()
+# the delete_all_* helpers don't commit, the calling operation commits once for everything it changed
+async def delete_all_event_participants(event_id: int, db: AsyncSession) -> list[int]:
+    deleted = await db.execute(delete(models.DBEventParticipants).where(
+        models.DBEventParticipants.event_id == event_id).returning(models.DBEventParticipants.user_id))
+    return deleted.scalars().all()
 
 
-async def delete_all_event_categories(event_id: int, db: Session):
-    db_event_categories = db.query(models.DBEventCategory).filter(
-        models.DBEventCategory.event_id == event_id).all()
-    for db_event_category in db_event_categories:
-        db.delete(db_event_category)
-    db.commit()
+async def delete_all_event_categories(event_id: int, db: AsyncSession):
+    await db.execute(delete(models.DBEventCategory).where(models.DBEventCategory.event_id == event_id))
 
 
-async def delete_category(category_id: int, db: Session):
+async def delete_category(category_id: int, db: AsyncSession):
     # TODO: Probably to remove
-    category = db.get(models.DBCategory, category_id)
-    db.delete(category)
-    db.commit()
+    category = await db.get(models.DBCategory, category_id)
+    await db.delete(category)
+    await db.commit()
 
 
-async def create_friend_request(db: Session, sender_id: int, recipient_id: int, friendship_status="pending") -> models.DBUserFriendship | dict:
-    try:
-        friendship = models.DBUserFriendship(user1_id=sender_id, user2_id=recipient_id, friendship_status=friendship_status)
+async def notify_friendship(friendship: models.DBUserFriendship, db: AsyncSession):
+    await notifications.notify([friendship.user1_id, friendship.user2_id], {
+        "type": "friendship",
+        "sender_id": friendship.user1_id,
+        "recipient_id": friendship.user2_id,
+        "friendship_status": friendship.friendship_status,
+    }, db=db)
 
-        db.add(friendship)
-        db.commit()
 
-        return friendship
+async def create_friend_request(db: AsyncSession, sender_id: int, recipient_id: int, friendship_status="pending") -> models.DBUserFriendship | dict:
+    # the pair is unique, so an existing request is detected by the insert itself instead of a SELECT first
+    try:
+        friendship = (await db.scalars(
+            pg_insert(models.DBUserFriendship)
+            .values(user1_id=sender_id, user2_id=recipient_id, friendship_status=friendship_status,
+                    sent_at=datetime.now())
+            .on_conflict_do_nothing(index_elements=["user1_id", "user2_id"])
+            .returning(models.DBUserFriendship))).first()
+        if friendship is not None:
+            await notify_friendship(friendship, db)
+        await db.commit()
     except IntegrityError as e:
+        await db.rollback()
         return {'error': repr(e)}
 
+    if friendship is None:
+        return {'error': 'Friend request already sent'}
+    if friendship_status == "accepted":
+        friend_graph.add(sender_id, recipient_id)
+    return friendship
+
 
-async def get_friend_request(db: Session, sender_id: int, recipient_id: int) -> models.DBUserFriendship | None:
-    friendship = db.query(models.DBUserFriendship).filter(and_(models.DBUserFriendship.user1_id == sender_id, models.DBUserFriendship.user2_id == recipient_id)).first()
+async def get_friend_request(db: AsyncSession, sender_id: int, recipient_id: int) -> models.DBUserFriendship | None:
+    friendship = (await db.execute(select(models.DBUserFriendship).where(and_(models.DBUserFriendship.user1_id == sender_id, models.DBUserFriendship.user2_id == recipient_id)))).scalars().first()
 
     return friendship
 
 
-async def alter_friend_request(db: Session, sender_id: int, recipient_id: int, action: str) -> models.DBUserFriendship | dict:
-    friendship = await get_friend_request(db, sender_id=sender_id, recipient_id=recipient_id)
+def friend_request_transition(sender_id: int, recipient_id: int, action: str):
+    # one statement: the pending request moves to action and the reverse row is written only if it did,
+    # a concurrent accept and cancel can't both match the pending status
+    friendship = models.DBUserFriendship.__table__
+    action_time = datetime.now()
+    updated = (update(friendship)
+               .where(friendship.c.user1_id == sender_id, friendship.c.user2_id == recipient_id,
+                      friendship.c.friendship_status == "pending")
+               .values(friendship_status=action, action_time=action_time)
+               .returning(*friendship.c)
+               .cte("updated"))
+    reverse = pg_insert(friendship).from_select(
+        ["user1_id", "user2_id", "friendship_status", "sent_at", "action_time"],
+        select(updated.c.user2_id, updated.c.user1_id, updated.c.friendship_status,
+               literal(action_time, models.TIMESTAMP), updated.c.action_time))
+    reverse = (reverse.on_conflict_do_update(
+        index_elements=["user1_id", "user2_id"],
+        set_={"friendship_status": reverse.excluded.friendship_status, "action_time": reverse.excluded.action_time})
+               .returning(friendship.c.friendship_id)
+               .cte("reverse"))
+    return select(aliased(models.DBUserFriendship, updated)).add_cte(reverse)
+
+
+async def alter_friend_request(db: AsyncSession, sender_id: int, recipient_id: int, action: str) -> models.DBUserFriendship | dict:
+    friendship = (await db.scalars(friend_request_transition(sender_id, recipient_id, action))).first()
+    if friendship is not None:
+        await notify_friendship(friendship, db)
+    await db.commit()
+
+    if friendship is None:
+        # only the failure path reads the row again, to tell why nothing changed
+        existing = await get_friend_request(db, sender_id=sender_id, recipient_id=recipient_id)
+        if existing:
+            return {"error": f"Friendship already {existing.friendship_status}"}
+        return {"error": "Friend request not found"}
+
+    if action == "accepted":
+        friend_graph.add(sender_id, recipient_id)
+    else:
+        friend_graph.remove(sender_id, recipient_id)
+    return friendship
 
-    if friendship:
-        if friendship.friendship_status in ['accepted', 'rejected', 'cancelled']:
-            return {"error": f"Friendship already {friendship.friendship_status}"}
 
-        friendship.friendship_status = action
-        friendship.action_time = datetime.now()
+async def get_category_ids_by_name(db: AsyncSession) -> dict[str, int]:
+    return dict((await db.execute(select(models.DBCategory.category_name, models.DBCategory.category_id).where(
+        models.DBCategory.category_name.is_not(None)))).all())
 
-        db.commit()
-        db.refresh(friendship)
 
-        reversed_friendship = await get_friend_request(db, sender_id=recipient_id, recipient_id=sender_id)
-        if reversed_friendship is None:
-            # create entry for recipient -> sender
-            await create_friend_request(db, sender_id=recipient_id, recipient_id=sender_id, friendship_status=action)
+async def get_active_friend_ids(user_id: int, db: AsyncSession) -> list[int]:
+    if friend_graph.loaded:
+        friends = select(models.DBUser.user_id).where(
+            user_id_in(friend_graph.friends_of(user_id)), models.DBUser.is_active == True)
+    else:
+        friends = friend_ids_query(user_id)
+    return (await db.execute(friends)).scalars().all()
+
+
+async def copy_records(table: str, columns: list[str], records: list[tuple], db: AsyncSession):
+    # COPY on the session's own connection, so it's part of the same transaction
+    if records:
+        connection = await (await db.connection()).get_raw_connection()
+        await connection.driver_connection.copy_records_to_table(table, records=records, columns=columns)
+
+
+async def insert_imported_events(user_id: int, events: list[importer.ImportedEvent], category_ids: dict[str, int],
+                                 friend_ids: list[int], db: AsyncSession) -> set[int]:
+    # ids come from the sequence up front, then every table is written with COPY instead of per-row INSERTs
+    event_sequence = models.DBEvent.__table__.c.event_id.default
+    event_ids = (await db.execute(select(event_sequence.next_value()).select_from(
+        func.generate_series(1, len(events))))).scalars().all()
+    now = datetime.now()
+    since, until = occurrences.window()
+    events_rows, category_rows, participant_rows, occurrence_rows, change_rows = [], [], [], [], []
+    affected_user_ids = {user_id}
+    for event, event_id in zip(events, event_ids):
+        event.event_id = event_id
+        events_rows.append((event_id, user_id, event.event_name, event.event_description, event.event_date_start,
+                            event.event_date_end, event.event_location, event.privacy, event.recurrence, None))
+        category_rows.extend((event_id, category_ids[name]) for name in set(event.category_names))
+        participant_rows.append((event_id, user_id, "accepted", "host", now))
+        change_rows.append((user_id, event_id, False))
+        if event.privacy == "public":
+            participant_rows.extend((event_id, friend_id, "pending", "member", now) for friend_id in friend_ids)
+            change_rows.extend((friend_id, event_id, False) for friend_id in friend_ids)
+            affected_user_ids.update(friend_ids)
+        occurrence_rows.extend((row["event_id"], row["occurrence_index"], row["occurrence_start"],
+                                row["occurrence_end"]) for row in occurrences.build_rows(event, 0, since, until))
+
+    await copy_records("db_event", ["event_id", "created_by", "event_name", "event_description", "event_date_start",
+                                    "event_date_end", "event_location", "privacy", "recurrence", "next_event_date"],
+                       events_rows, db=db)
+    await copy_records("db_event_category", ["event_id", "category_id"], category_rows, db=db)
+    await copy_records("db_event_participants", ["event_id", "user_id", "participant_status", "participant_role",
+                                                 "response_time"], participant_rows, db=db)
+    await copy_records("db_event_occurrence", ["event_id", "occurrence_index", "occurrence_start", "occurrence_end"],
+                       occurrence_rows, db=db)
+    await copy_records("db_event_change", ["user_id", "event_id", "deleted"], change_rows, db=db)
+    await notifications.notify(affected_user_ids, {"type": "events_imported", "count": len(events)}, db=db)
+    return affected_user_ids
+
+
+async def import_events(user_id: int, rows, db: AsyncSession) -> dict:
+    category_ids = await get_category_ids_by_name(db)
+    friend_ids = None
+    report = {"imported": 0, "failed": 0, "errors": [], "errors_truncated": False}
+
+    def fail(row: int, message: str):
+        report["failed"] += 1
+        if len(report["errors"]) < importer.MAX_REPORTED_ERRORS:
+            report["errors"].append({"row": row, "message": message})
         else:
-            reversed_friendship.friendship_status = action
-            reversed_friendship.action_time = datetime.now()
-
-            db.commit()
-            db.refresh(reversed_friendship)
-
-        return friendship
-    return {"error": "Friend request not found"}
+            report["errors_truncated"] = True
+
+    async def write(batch: list[importer.ImportedEvent]):
+        try:
+            affected_user_ids = await insert_imported_events(user_id, batch, category_ids, friend_ids, db=db)
+            await db.commit()
+        except Exception as e:
+            await db.rollback()
+            for event in batch:
+                fail(event.row, f"batch failed: {e}")
+            return
+        report["imported"] += len(batch)
+        availability.busy_cache.invalidate(affected_user_ids)
+
+    batch = []
+    for row, event in rows:
+        if isinstance(event, importer.InvalidRow):
+            fail(row, str(event))
+            continue
+        unknown = sorted(set(event.category_names) - category_ids.keys())
+        if unknown:
+            fail(row, f"unknown categories: {', '.join(unknown)}")
+            continue
+        if event.privacy == "public" and friend_ids is None:
+            friend_ids = await get_active_friend_ids(user_id, db)
+        batch.append(event)
+        if len(batch) == importer.BATCH_SIZE:
+            await write(batch)
+            batch = []
+    if batch:
+        await write(batch)
+    return report
@@ -1,7 +1,10 @@
-from sqlalchemy import create_engine
+from sqlalchemy.engine import make_url
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import AsyncAdaptedQueuePool
 import configparser
+import time
 
 
 config = configparser.ConfigParser()
@@ -14,11 +17,80 @@ PASSWORD = config["PSQL"]["PASSWORD"]
 PORT = config["PSQL"]["PORT"]
 HOST = config["PSQL"]["HOST"]
 
+# pool settings are optional in config.ini, defaults match sqlalchemy's own
+POOL_SIZE = config["PSQL"].getint("POOL_SIZE", fallback=5)
+MAX_OVERFLOW = config["PSQL"].getint("MAX_OVERFLOW", fallback=10)
+POOL_TIMEOUT = config["PSQL"].getfloat("POOL_TIMEOUT", fallback=30)
+POOL_RECYCLE = config["PSQL"].getint("POOL_RECYCLE", fallback=-1)
+POOL_PRE_PING = config["PSQL"].getboolean("POOL_PRE_PING", fallback=False)
+# milliseconds, 0 disables the timeout (postgres default)
+STATEMENT_TIMEOUT = config["PSQL"].getint("STATEMENT_TIMEOUT", fallback=0)
+
 DATABASE_URL = DATABASE_URL.format(DATABASE=DATABASE, USER=USER, PASSWORD=PASSWORD, PORT=PORT, HOST=HOST)
-print(DATABASE_URL)
+# config.ini keeps the plain postgresql:// url, the app always talks to postgres through asyncpg
+DATABASE_URL = make_url(DATABASE_URL).set(drivername="postgresql+asyncpg")
+
+
+class PoolWaitStats:
+    def __init__(self):
+        self.checkouts = 0
+        self.timeouts = 0
+        self.wait_seconds_total = 0.0
+        self.wait_seconds_max = 0.0
+
+    def record(self, waited: float, timed_out: bool = False):
+        if timed_out:
+            self.timeouts += 1
+        else:
+            self.checkouts += 1
+        self.wait_seconds_total += waited
+        self.wait_seconds_max = max(self.wait_seconds_max, waited)
+
+
+pool_wait_stats = PoolWaitStats()
 
-_engine = create_engine(DATABASE_URL)
 
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=_engine)
+class InstrumentedQueuePool(AsyncAdaptedQueuePool):
+    # _do_get is where QueuePool blocks for a free connection, so timing it gives the checkout wait
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            connection = super()._do_get()
+        except PoolTimeoutError:
+            pool_wait_stats.record(time.perf_counter() - started, timed_out=True)
+            raise
+        pool_wait_stats.record(time.perf_counter() - started)
+        return connection
+
+
+_engine = create_async_engine(
+    DATABASE_URL,
+    poolclass=InstrumentedQueuePool,
+    pool_size=POOL_SIZE,
+    max_overflow=MAX_OVERFLOW,
+    pool_timeout=POOL_TIMEOUT,
+    pool_recycle=POOL_RECYCLE,
+    pool_pre_ping=POOL_PRE_PING,
+    connect_args={"server_settings": {"statement_timeout": str(STATEMENT_TIMEOUT)}},
+)
+
+# expire_on_commit=False - attributes can't be lazy reloaded outside of await, so keep them after commit
+SessionLocal = async_sessionmaker(autocommit=False, autoflush=False, expire_on_commit=False, bind=_engine)
 
 Base = declarative_base()
+
+
+def pool_stats() -> dict:
+    pool = _engine.sync_engine.pool
+    return {
+        "pool_size": pool.size(),
+        "max_overflow": MAX_OVERFLOW,
+        "checked_in": pool.checkedin(),
+        "in_use": pool.checkedout(),
+        # QueuePool counts overflow from -pool_size, only connections above pool_size are interesting
+        "overflow": max(pool.overflow(), 0),
+        "checkouts": pool_wait_stats.checkouts,
+        "checkout_timeouts": pool_wait_stats.timeouts,
+        "checkout_wait_seconds_total": pool_wait_stats.wait_seconds_total,
+        "checkout_wait_seconds_max": pool_wait_stats.wait_seconds_max,
+    }
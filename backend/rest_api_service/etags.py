@@ -0,0 +1,29 @@
+import hashlib
+
+from fastapi import Header, Response
+
+
+IfNoneMatchHeader = Header(None)
+
+
+def make_etag(*parts) -> str:
+    # the parts are a few cheap versions, hashing keeps page parameters and friend ids out of the header
+    return '"' + hashlib.blake2b(repr(parts).encode(), digest_size=12).hexdigest() + '"'
+
+
+def matches(if_none_match: str | None, etag: str) -> bool:
+    if if_none_match is None:
+        return False
+    # If-None-Match compares weakly, a W/ prefix added by a proxy still matches
+    candidates = {candidate.strip().removeprefix("W/") for candidate in if_none_match.split(",")}
+    return "*" in candidates or etag in candidates
+
+
+def not_modified(etag: str) -> Response:
+    return Response(status_code=304, headers={"ETag": etag, "Cache-Control": "no-cache"})
+
+
+def set_etag(response: Response, etag: str):
+    # no-cache makes browsers revalidate every time, with the etag that costs a 304
+    response.headers["ETag"] = etag
+    response.headers["Cache-Control"] = "no-cache"
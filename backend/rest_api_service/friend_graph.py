@@ -0,0 +1,138 @@
+import asyncio
+import os
+from collections import Counter
+from datetime import timedelta
+
+from dotenv import load_dotenv
+from sqlalchemy import BigInteger, cast, func, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+import models
+from database import SessionLocal
+
+
+load_dotenv()
+
+CHECK_INTERVAL = timedelta(seconds=float(os.getenv("FRIEND_GRAPH_CHECK_SECONDS", 300)))
+# multiplier of the smaller id in the per-pair checksum, the same formula is computed in sql
+CHECKSUM_FACTOR = 2654435761
+
+
+def pair(user1_id: int, user2_id: int) -> tuple[int, int]:
+    return min(user1_id, user2_id), max(user1_id, user2_id)
+
+
+def pair_checksum(low: int, high: int) -> int:
+    return low * CHECKSUM_FACTOR + high
+
+
+class FriendGraph:
+    # accepted friendships as undirected adjacency sets, per process
+    # writes in this worker are applied right away, other workers converge on the next consistency check
+    def __init__(self):
+        self._friends: dict[int, set[int]] = {}
+        self.loaded = False
+        self.edges = 0
+        self.checksum = 0
+        self.checks = 0
+        self.reloads = 0
+
+    def friends_of(self, user_id: int) -> frozenset[int]:
+        return frozenset(self._friends.get(user_id, ()))
+
+    def mutual_friend_counts(self, user_id: int, max_edges: int) -> Counter:
+        # two hops from user_id, friends with the fewest friends first so hubs are the ones cut off
+        friends = self._friends.get(user_id, set())
+        counts = Counter()
+        visited = 0
+        for friend_id in sorted(friends, key=lambda friend: len(self._friends[friend])):
+            friends_of_friend = self._friends[friend_id]
+            visited += len(friends_of_friend)
+            if visited > max_edges:
+                break
+            counts.update(friends_of_friend)
+        counts.pop(user_id, None)
+        for friend_id in friends:
+            counts.pop(friend_id, None)
+        return counts
+
+    def add(self, user1_id: int, user2_id: int):
+        low, high = pair(user1_id, user2_id)
+        if low == high or high in self._friends.get(low, ()):
+            return
+        self._friends.setdefault(low, set()).add(high)
+        self._friends.setdefault(high, set()).add(low)
+        self.edges += 1
+        self.checksum += pair_checksum(low, high)
+
+    def remove(self, user1_id: int, user2_id: int):
+        low, high = pair(user1_id, user2_id)
+        if high not in self._friends.get(low, ()):
+            return
+        for user_id, friend_id in ((low, high), (high, low)):
+            friends = self._friends[user_id]
+            friends.discard(friend_id)
+            if not friends:
+                del self._friends[user_id]
+        self.edges -= 1
+        self.checksum -= pair_checksum(low, high)
+
+    def replace(self, pairs):
+        self._friends = {}
+        self.edges = 0
+        self.checksum = 0
+        for user1_id, user2_id in pairs:
+            self.add(user1_id, user2_id)
+        self.loaded = True
+
+    def stats(self) -> dict:
+        return {
+            "loaded": self.loaded,
+            "users": len(self._friends),
+            "edges": self.edges,
+            "checks": self.checks,
+            "reloads": self.reloads,
+        }
+
+
+friend_graph = FriendGraph()
+
+
+def accepted_pairs_query():
+    # a friendship is stored once per direction after it is accepted, the pair collapses both rows
+    friendship = models.DBUserFriendship
+    return select(
+        func.least(friendship.user1_id, friendship.user2_id).label("low"),
+        func.greatest(friendship.user1_id, friendship.user2_id).label("high"),
+    ).where(friendship.friendship_status == "accepted", friendship.user1_id != friendship.user2_id).distinct()
+
+
+async def load(db: AsyncSession):
+    pairs = (await db.execute(accepted_pairs_query())).all()
+    friend_graph.replace(pairs)
+    friend_graph.reloads += 1
+
+
+async def check_consistency(db: AsyncSession) -> bool:
+    # compares edge count and checksum in one aggregate, the pairs are only transferred again on a mismatch
+    pairs = accepted_pairs_query().subquery()
+    edges, checksum = (await db.execute(select(
+        func.count(),
+        func.coalesce(func.sum(cast(pairs.c.low, BigInteger) * CHECKSUM_FACTOR + pairs.c.high), 0),
+    ).select_from(pairs))).one()
+    friend_graph.checks += 1
+    if friend_graph.loaded and (edges, int(checksum)) == (friend_graph.edges, friend_graph.checksum):
+        return True
+    await load(db)
+    return False
+
+
+async def run_consistency_job():
+    while True:
+        try:
+            async with SessionLocal() as db:
+                if not await check_consistency(db):
+                    print(f"Friend graph reloaded with {friend_graph.edges} friendships")
+        except Exception as e:
+            print(f"Friend graph consistency check failed: {e}")
+        await asyncio.sleep(CHECK_INTERVAL.total_seconds())
@@ -0,0 +1,109 @@
+from datetime import UTC, datetime
+from typing import AsyncIterator
+
+from fastapi.responses import StreamingResponse
+
+import recurrence
+from database import SessionLocal
+
+
+PRODID = "-//time_management_web_app//calendar export//EN"
+UID_DOMAIN = "time-management-web-app"
+# RFC 5545 lines are at most 75 octets, longer ones continue on lines starting with a space
+MAX_LINE_OCTETS = 75
+
+FREQUENCIES = {
+    "daily": "DAILY",
+    "weekly": "WEEKLY",
+    "monthly": "MONTHLY",
+    "yearly": "YEARLY",
+}
+
+
+def escape_text(value: str) -> str:
+    return (value.replace("\\", "\\\\").replace(";", "\\;").replace(",", "\\,")
+            .replace("\r\n", "\\n").replace("\n", "\\n"))
+
+
+def fold(line: str) -> str:
+    encoded = line.encode()
+    if len(encoded) <= MAX_LINE_OCTETS:
+        return line + "\r\n"
+    parts = []
+    limit = MAX_LINE_OCTETS
+    while encoded:
+        cut = min(limit, len(encoded))
+        # never split a multi-byte character
+        while cut < len(encoded) and encoded[cut] & 0xC0 == 0x80:
+            cut -= 1
+        parts.append(encoded[:cut].decode())
+        encoded = encoded[cut:]
+        # the leading space of a continuation line counts against the limit
+        limit = MAX_LINE_OCTETS - 1
+    return "\r\n ".join(parts) + "\r\n"
+
+
+def format_datetime(value: datetime) -> str:
+    # db_event timestamps have no time zone, so they're exported as floating local times
+    if value.tzinfo is not None:
+        return value.astimezone(UTC).strftime("%Y%m%dT%H%M%SZ")
+    return value.strftime("%Y%m%dT%H%M%S")
+
+
+def rrule(event) -> str | None:
+    if not recurrence.is_recurring(event):
+        return None
+    rule = f"FREQ={FREQUENCIES[event.recurrence]}"
+    start = event.event_date_start
+    # recurrence.add_months clamps the 29th-31st to the last day of shorter months, a plain monthly
+    # RRULE would skip those months instead, so the day is picked as the last of the candidates
+    if event.recurrence in recurrence.MONTH_STEPS and start.day > 28:
+        month_days = ",".join(str(day) for day in range(28, start.day + 1))
+        if event.recurrence == "yearly":
+            rule += f";BYMONTH={start.month}"
+        rule += f";BYMONTHDAY={month_days};BYSETPOS=-1"
+    return rule
+
+
+def event_lines(event, stamp: str) -> list[str]:
+    lines = [
+        "BEGIN:VEVENT",
+        f"UID:event-{event.event_id}@{UID_DOMAIN}",
+        f"DTSTAMP:{stamp}",
+        f"DTSTART:{format_datetime(event.event_date_start)}",
+        f"DTEND:{format_datetime(event.event_date_end)}",
+        f"SUMMARY:{escape_text(event.event_name)}",
+    ]
+    rule = rrule(event)
+    if rule is not None:
+        lines.append(f"RRULE:{rule}")
+    if event.event_description:
+        lines.append(f"DESCRIPTION:{escape_text(event.event_description)}")
+    if event.event_location:
+        lines.append(f"LOCATION:{escape_text(event.event_location)}")
+    category_names = [category.category_name for category in event.categories if category.category_name]
+    if category_names:
+        lines.append("CATEGORIES:" + ",".join(escape_text(name) for name in category_names))
+    lines.append("CLASS:" + ("PRIVATE" if event.privacy == "private" else "PUBLIC"))
+    lines.append("END:VEVENT")
+    return lines
+
+
+async def calendar(events: AsyncIterator) -> AsyncIterator[str]:
+    # one chunk per event, nothing but the current batch of rows is held in memory
+    stamp = format_datetime(datetime.now(UTC))
+    yield "".join(fold(line) for line in ["BEGIN:VCALENDAR", "VERSION:2.0", f"PRODID:{PRODID}", "CALSCALE:GREGORIAN"])
+    async for event in events:
+        yield "".join(fold(line) for line in event_lines(event, stamp))
+    yield fold("END:VCALENDAR")
+
+
+def ics_response(stream_events, filename: str) -> StreamingResponse:
+    # like pagination.ndjson_response, the stream opens its own session
+    async def body():
+        async with SessionLocal() as db:
+            async for chunk in calendar(stream_events(db)):
+                yield chunk
+
+    return StreamingResponse(body(), media_type="text/calendar; charset=utf-8",
+                             headers={"Content-Disposition": f'attachment; filename="{filename}"'})
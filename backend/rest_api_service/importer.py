@@ -0,0 +1,281 @@
+import csv
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import Iterable, Iterator
+
+import recurrence
+
+
+# events written per transaction, occurrences are only built inside occurrences.window(), so even a daily series
+# that started years ago adds at most ~900 rows and a batch stays under ~460k occurrence tuples
+BATCH_SIZE = 500
+MAX_REPORTED_ERRORS = 1000
+PRIVACY_LEVELS = ("public", "private")
+RECURRENCES = (*recurrence.FIXED_STEPS, *recurrence.MONTH_STEPS)
+MAX_NAME_LENGTH = 60
+MAX_TEXT_LENGTH = 255
+
+CSV_COLUMNS = ("event_name", "event_description", "event_date_start", "event_date_end", "event_location",
+               "privacy", "recurrence", "categories")
+CSV_REQUIRED_COLUMNS = ("event_name", "event_date_start", "event_date_end", "recurrence")
+# CATEGORIES in csv are separated by ; so that names may contain commas
+CSV_CATEGORY_SEPARATOR = ";"
+
+ICS_FREQUENCIES = {"DAILY": "daily", "WEEKLY": "weekly", "MONTHLY": "monthly", "YEARLY": "yearly"}
+ICS_IGNORED_RRULE_PARTS = {"FREQ", "INTERVAL", "WKST"}
+# only accepted with the values ics.rrule writes for the series' DTSTART, any other value moves the dates
+ICS_ANCHOR_RRULE_PARTS = {"BYMONTHDAY", "BYMONTH", "BYSETPOS"}
+
+
+class InvalidRow(ValueError):
+    pass
+
+
+@dataclass(slots=True)
+class ImportedEvent:
+    row: int
+    event_name: str
+    event_description: str | None
+    event_date_start: datetime
+    event_date_end: datetime
+    event_location: str | None
+    privacy: str
+    recurrence: str
+    category_names: list[str]
+    # allocated right before the batch is written
+    event_id: int | None = None
+
+
+def validate(row: int, fields: dict) -> ImportedEvent:
+    event_name = (fields.get("event_name") or "").strip()
+    if not event_name:
+        raise InvalidRow("event_name is required")
+    if len(event_name) > MAX_NAME_LENGTH:
+        raise InvalidRow(f"event_name is longer than {MAX_NAME_LENGTH} characters")
+    for field in ("event_description", "event_location"):
+        if fields.get(field) and len(fields[field]) > MAX_TEXT_LENGTH:
+            raise InvalidRow(f"{field} is longer than {MAX_TEXT_LENGTH} characters")
+    start, end = fields.get("event_date_start"), fields.get("event_date_end")
+    if start is None or end is None:
+        raise InvalidRow("event_date_start and event_date_end are required")
+    if end < start:
+        raise InvalidRow("event_date_end is before event_date_start")
+    privacy = fields.get("privacy") or "private"
+    if privacy not in PRIVACY_LEVELS:
+        raise InvalidRow(f"privacy must be one of {', '.join(PRIVACY_LEVELS)}")
+    recurrence_rule = fields.get("recurrence")
+    if recurrence_rule not in RECURRENCES:
+        raise InvalidRow(f"recurrence must be one of {', '.join(RECURRENCES)}")
+    return ImportedEvent(
+        row=row,
+        event_name=event_name,
+        event_description=fields.get("event_description") or None,
+        event_date_start=start,
+        event_date_end=end,
+        event_location=fields.get("event_location") or None,
+        privacy=privacy,
+        recurrence=recurrence_rule,
+        category_names=fields.get("category_names", []),
+    )
+
+
+def parse_csv_datetime(value: str | None) -> datetime | None:
+    if not value:
+        return None
+    try:
+        parsed = datetime.fromisoformat(value.strip())
+    except ValueError:
+        raise InvalidRow(f"{value!r} is not an ISO 8601 date") from None
+    # db_event times are naive, an aware value compares neither with them nor with the occurrence horizon
+    if parsed.tzinfo is not None:
+        raise InvalidRow(f"{value!r} has a UTC offset, dates are local times without one")
+    return parsed
+
+
+def parse_csv(lines: Iterable[str]) -> Iterator[tuple[int, dict | InvalidRow]]:
+    reader = csv.DictReader(lines)
+    missing = [column for column in CSV_REQUIRED_COLUMNS if column not in (reader.fieldnames or ())]
+    if missing:
+        yield 1, InvalidRow(f"missing csv columns: {', '.join(missing)}")
+        return
+    for fields in reader:
+        try:
+            yield reader.line_num, {
+                **{column: (fields.get(column) or "").strip() or None for column in CSV_COLUMNS},
+                "event_date_start": parse_csv_datetime(fields.get("event_date_start")),
+                "event_date_end": parse_csv_datetime(fields.get("event_date_end")),
+                "category_names": [name.strip() for name in (fields.get("categories") or "").split(
+                    CSV_CATEGORY_SEPARATOR) if name.strip()],
+            }
+        except InvalidRow as e:
+            yield reader.line_num, e
+
+
+def unescape_ics_text(value: str) -> str:
+    result = []
+    escaped = False
+    for character in value:
+        if escaped:
+            result.append("\n" if character in "nN" else character)
+            escaped = False
+        elif character == "\\":
+            escaped = True
+        else:
+            result.append(character)
+    return "".join(result)
+
+
+def split_ics_list(value: str) -> list[str]:
+    # split on commas that aren't escaped
+    items, current, escaped = [], [], False
+    for character in value:
+        if escaped:
+            current.append("\\" + character)
+            escaped = False
+        elif character == "\\":
+            escaped = True
+        elif character == ",":
+            items.append(unescape_ics_text("".join(current)))
+            current = []
+        else:
+            current.append(character)
+    items.append(unescape_ics_text("".join(current)))
+    return [item.strip() for item in items if item.strip()]
+
+
+def parse_ics_datetime(params: dict, value: str) -> tuple[datetime, bool]:
+    # (value, is_date), db_event times are naive, so like offsets in csv only floating times are accepted
+    if value.endswith("Z") or "TZID" in params:
+        raise InvalidRow(f"{value!r} is a UTC or TZID time, dates are local times without a time zone")
+    try:
+        if params.get("VALUE") == "DATE" or len(value) == 8:
+            return datetime.strptime(value, "%Y%m%d"), True
+        return datetime.strptime(value, "%Y%m%dT%H%M%S"), False
+    except ValueError:
+        raise InvalidRow(f"{value!r} is not an iCalendar date") from None
+
+
+def month_end_anchor(frequency: str, start: datetime) -> dict[str, str]:
+    # the parts ics.rrule writes next to FREQ, recurrence.add_months clamps the 29th-31st to the end of the month
+    anchor = {}
+    if frequency in recurrence.MONTH_STEPS and start.day > 28:
+        if frequency == "yearly":
+            anchor["BYMONTH"] = str(start.month)
+        anchor["BYMONTHDAY"] = ",".join(str(day) for day in range(28, start.day + 1))
+        anchor["BYSETPOS"] = "-1"
+    return anchor
+
+
+def clamps_to_month_end(frequency: str, start: datetime) -> bool:
+    # a plain RRULE skips the months without the day, the series stored here moves to their last day instead
+    return (frequency == "monthly" and start.day > 28) or (frequency == "yearly" and (start.month, start.day) == (2, 29))
+
+
+def parse_rrule(value: str, start: datetime) -> str:
+    parts = dict(part.split("=", 1) for part in value.split(";") if "=" in part)
+    if parts.get("INTERVAL", "1") != "1":
+        raise InvalidRow("RRULE with INTERVAL other than 1 is not supported")
+    unsupported = sorted(parts.keys() - ICS_IGNORED_RRULE_PARTS - ICS_ANCHOR_RRULE_PARTS)
+    if unsupported:
+        raise InvalidRow(f"RRULE parts {', '.join(unsupported)} are not supported")
+    frequency = ICS_FREQUENCIES.get(parts.get("FREQ", ""))
+    if frequency is None:
+        raise InvalidRow(f"RRULE FREQ {parts.get('FREQ')!r} is not supported")
+    anchor = {part: parts[part] for part in ICS_ANCHOR_RRULE_PARTS if part in parts}
+    if frequency == "yearly" and anchor == {"BYMONTH": str(start.month)}:
+        # the month of DTSTART, which FREQ=YEARLY repeats anyway
+        anchor = {}
+    if anchor and anchor != month_end_anchor(frequency, start):
+        raise InvalidRow("RRULE BYMONTH, BYMONTHDAY and BYSETPOS are only supported in the month-end form of the "
+                         "DTSTART day, other values repeat on different dates")
+    if not anchor and clamps_to_month_end(frequency, start):
+        raise InvalidRow(f"RRULE FREQ={parts['FREQ']} from day {start.day} skips shorter months, events here move to "
+                         f"their last day, write BYMONTHDAY={month_end_anchor(frequency, start)['BYMONTHDAY']};"
+                         f"BYSETPOS=-1 for that")
+    return frequency
+
+
+def unfold_ics(lines: Iterable[str]) -> Iterator[tuple[int, str]]:
+    # continuation lines start with a space or a tab, the line number is the one of the first physical line
+    current, current_number = None, 0
+    for number, line in enumerate(lines, start=1):
+        line = line.rstrip("\r\n")
+        if line[:1] in (" ", "\t") and current is not None:
+            current += line[1:]
+            continue
+        if current is not None:
+            yield current_number, current
+        current, current_number = line, number
+    if current is not None:
+        yield current_number, current
+
+
+def ics_event_fields(properties: dict[str, tuple[dict, str]]) -> dict:
+    fields = {}
+    if "SUMMARY" in properties:
+        fields["event_name"] = unescape_ics_text(properties["SUMMARY"][1])
+    if "DESCRIPTION" in properties:
+        fields["event_description"] = unescape_ics_text(properties["DESCRIPTION"][1])
+    if "LOCATION" in properties:
+        fields["event_location"] = unescape_ics_text(properties["LOCATION"][1])
+    if "CATEGORIES" in properties:
+        fields["category_names"] = split_ics_list(properties["CATEGORIES"][1])
+    if "CLASS" in properties:
+        fields["privacy"] = "public" if properties["CLASS"][1].upper() == "PUBLIC" else "private"
+    if "RRULE" not in properties:
+        raise InvalidRow("events without RRULE can't be stored, every event here recurs")
+    if "DTSTART" not in properties:
+        raise InvalidRow("DTSTART is required")
+    start, all_day = parse_ics_datetime(*properties["DTSTART"])
+    fields["recurrence"] = parse_rrule(properties["RRULE"][1].upper(), start)
+    fields["event_date_start"] = start
+    if "DTEND" in properties:
+        fields["event_date_end"] = parse_ics_datetime(*properties["DTEND"])[0]
+    else:
+        # RFC 5545 3.6.1, without DTEND a date lasts one day and a date-time takes no time
+        fields["event_date_end"] = start + timedelta(days=1) if all_day else start
+    return fields
+
+
+def parse_ics(lines: Iterable[str]) -> Iterator[tuple[int, dict | InvalidRow]]:
+    properties = None
+    event_row = 0
+    # depth of components nested in the event (VALARM), their properties aren't the event's
+    nested = 0
+    for number, line in unfold_ics(lines):
+        name_and_params, _, value = line.partition(":")
+        name, *raw_params = name_and_params.split(";")
+        name, value_name = name.upper(), value.upper()
+        if properties is None:
+            if name == "BEGIN" and value_name == "VEVENT":
+                properties, event_row, nested = {}, number, 0
+        elif name == "BEGIN":
+            nested += 1
+        elif name == "END" and nested:
+            nested -= 1
+        elif name == "END" and value_name == "VEVENT":
+            try:
+                yield event_row, ics_event_fields(properties)
+            except InvalidRow as e:
+                yield event_row, e
+            properties = None
+        elif not nested:
+            params = dict(param.split("=", 1) for param in raw_params if "=" in param)
+            properties[name] = ({key.upper(): value for key, value in params.items()}, value)
+
+
+def format_of(filename: str | None) -> str | None:
+    extension = (filename or "").rpartition(".")[2].lower()
+    return extension if extension in ("csv", "ics") else None
+
+
+def parse(file_format: str, lines: Iterable[str]) -> Iterator[tuple[int, ImportedEvent | InvalidRow]]:
+    rows = parse_csv(lines) if file_format == "csv" else parse_ics(lines)
+    for row, fields in rows:
+        if isinstance(fields, InvalidRow):
+            yield row, fields
+            continue
+        try:
+            yield row, validate(row, fields)
+        except InvalidRow as e:
+            yield row, e
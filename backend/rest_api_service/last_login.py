@@ -0,0 +1,104 @@
+import asyncio
+import os
+import time
+from datetime import datetime
+
+from dotenv import load_dotenv
+from sqlalchemy import Integer, TIMESTAMP, column, func, update, values
+from sqlalchemy.ext.asyncio import AsyncSession
+
+import models
+from database import SessionLocal
+from user_cache import user_cache
+
+
+load_dotenv()
+
+FLUSH_INTERVAL_SECONDS = float(os.getenv("LAST_LOGIN_FLUSH_SECONDS", 5))
+ROWS_PER_STATEMENT = 1000
+
+
+class LastLoginBuffer:
+    # logins only touch this dict, a background job writes them in batches
+    # a user logging in again before the flush just moves the timestamp, so a login storm is one row per user
+    def __init__(self):
+        self._pending: dict[int, datetime] = {}
+        # monotonic time the oldest pending login was recorded, None when nothing is pending
+        self._oldest: float | None = None
+        self.flushes = 0
+        self.failures = 0
+        self.rows_flushed = 0
+        self.last_flush_lag = 0.0
+        self.max_flush_lag = 0.0
+
+    def record(self, user_id: int, logged_in_at: datetime):
+        if self._oldest is None:
+            self._oldest = time.monotonic()
+        previous = self._pending.get(user_id)
+        if previous is None or logged_in_at > previous:
+            self._pending[user_id] = logged_in_at
+
+    async def flush(self, db: AsyncSession):
+        if not self._pending:
+            return
+        pending, oldest = self._pending, self._oldest
+        self._pending, self._oldest = {}, None
+        try:
+            rows = list(pending.items())
+            for first in range(0, len(rows), ROWS_PER_STATEMENT):
+                await db.execute(last_login_update(rows[first:first + ROWS_PER_STATEMENT]))
+            await db.commit()
+        except BaseException as e:
+            # also on cancellation, the batch is put back before anything else is awaited so shutdown still writes it
+            # logins recorded in the meantime are newer and win
+            for user_id, logged_in_at in pending.items():
+                self.record(user_id, logged_in_at)
+            self._oldest = min(oldest, self._oldest)
+            if isinstance(e, Exception):
+                self.failures += 1
+            await db.rollback()
+            raise
+        for user_id in pending:
+            user_cache.invalidate(user_id)
+        self.flushes += 1
+        self.rows_flushed += len(pending)
+        self.last_flush_lag = time.monotonic() - oldest
+        self.max_flush_lag = max(self.max_flush_lag, self.last_flush_lag)
+
+    def stats(self) -> dict:
+        return {
+            "pending": len(self._pending),
+            "pending_age_seconds": time.monotonic() - self._oldest if self._oldest is not None else 0.0,
+            "flushes": self.flushes,
+            "failures": self.failures,
+            "rows_flushed": self.rows_flushed,
+            "last_flush_lag_seconds": self.last_flush_lag,
+            "max_flush_lag_seconds": self.max_flush_lag,
+        }
+
+
+last_login_buffer = LastLoginBuffer()
+
+
+def last_login_update(rows: list[tuple[int, datetime]]):
+    # UPDATE db_user ... FROM (VALUES ...), greatest() keeps a newer login written by another worker
+    logins = values(column("user_id", Integer), column("last_login", TIMESTAMP), name="logins").data(rows)
+    user = models.DBUser.__table__
+    return (update(user)
+            .where(user.c.user_id == logins.c.user_id)
+            .values(last_login=func.greatest(user.c.last_login, logins.c.last_login),
+                    update_date=func.greatest(user.c.update_date, logins.c.last_login)))
+
+
+async def flush():
+    async with SessionLocal() as db:
+        await last_login_buffer.flush(db)
+
+
+async def run_flush_job():
+    while True:
+        await asyncio.sleep(FLUSH_INTERVAL_SECONDS)
+        try:
+            await flush()
+        except Exception as e:
+            print(f"Flushing last logins failed: {e}")
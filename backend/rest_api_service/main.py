@@ -1,19 +1,35 @@
-import bcrypt
+import asyncio
+import io
+import availability
 import crud
-from database import SessionLocal
-from sqlalchemy.orm import Session
+import etags
+import friend_graph
+import importer
+import ics
+import last_login
+import metrics
+import notifications
+import suggestions
+import occurrences
+import pagination
+import passwords
+from user_cache import user_cache
+from database import SessionLocal, pool_stats
+from sqlalchemy.ext.asyncio import AsyncSession
 from schemas import *
 import pytz
-from passlib.context import CryptContext
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
 import jwt
 from datetime import datetime, timedelta, UTC, date
 from dotenv import load_dotenv
 import os
 from models import *
-from fastapi import FastAPI, HTTPException, status, Depends, Response
-from typing import Union
+from fastapi import FastAPI, HTTPException, status, Depends, Response, Query, UploadFile, WebSocket, WebSocketDisconnect
+from pagination import CursorQuery, LimitQuery
+from typing import Literal, Union
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import ORJSONResponse
+from contextlib import asynccontextmanager
 
 
 # Load environment variables from .env file
@@ -23,10 +39,34 @@ SECRET_KEY = os.getenv("SECRET_KEY")
 ALGORITHM = os.getenv("ALGORITHM")
 ACCESS_TOKEN_EXPIRE_MINUTES = int(os.getenv("ACCESS_TOKEN_EXPIRE_MINUTES"))
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
 
-app = FastAPI()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    horizon_job = asyncio.create_task(occurrences.run_horizon_job())
+    friend_graph_job = asyncio.create_task(friend_graph.run_consistency_job())
+    last_login_job = asyncio.create_task(last_login.run_flush_job())
+    listener_job = asyncio.create_task(notifications.run_listener())
+    yield
+    horizon_job.cancel()
+    friend_graph_job.cancel()
+    last_login_job.cancel()
+    listener_job.cancel()
+    try:
+        # a flush cancelled halfway puts its batch back, it has to be done before the final one
+        await last_login_job
+    except asyncio.CancelledError:
+        pass
+    try:
+        await last_login.flush()
+    except Exception as e:
+        print(f"Flushing last logins on shutdown failed: {e}")
+    passwords.shutdown()
+
+
+# routes with a response_model are serialized by pydantic-core, orjson only renders the result
+app = FastAPI(lifespan=lifespan, default_response_class=ORJSONResponse)
 utc = pytz.UTC
 
 origins = ["*"]
@@ -37,16 +77,25 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=[pagination.NEXT_CURSOR_HEADER, "ETag"],
 )
+app.add_middleware(metrics.MetricsMiddleware)
+
+metrics.register_stats({
+    "db_pool": pool_stats,
+    "password_hashing": passwords.password_stats,
+    "user_cache": user_cache.stats,
+    "busy_cache": availability.busy_cache.stats,
+    "friend_graph": friend_graph.friend_graph.stats,
+    "last_login": last_login.last_login_buffer.stats,
+    "calendar_updates": notifications.hub.stats,
+})
 
 
 # Dependency
-def get_db():
-    db = SessionLocal()
-    try:
+async def get_db():
+    async with SessionLocal() as db:
         yield db
-    finally:
-        db.close()
 
 
 def create_access_token(data: dict, expires_delta: timedelta = None):
@@ -60,15 +109,7 @@ def create_access_token(data: dict, expires_delta: timedelta = None):
     return encoded_jwt
 
 
-def verify_password(plain_password, hashed_password):
-    return pwd_context.verify(plain_password, hashed_password)
-
-
-def get_password_hash(password):
-    return pwd_context.hash(password)
-
-
-async def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
+async def get_current_user(token: str = Depends(oauth2_scheme), db: AsyncSession = Depends(get_db)):
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
@@ -82,16 +123,33 @@ async def get_current_user(token: str = Depends(oauth2_scheme), db: Session = De
         token_data = TokenData(username=username)
     except jwt.PyJWTError:
         raise credentials_exception
+    cached_user = user_cache.get(token_data.username)
+    if cached_user is not None:
+        return cached_user
     user = await crud.get_user_by_username(db, username=token_data.username)
     if user is None:
         raise credentials_exception
-    return user
+    cached_user = UserSchema.model_validate(user)
+    user_cache.put(token_data.username, cached_user)
+    return cached_user
+
+
+async def get_current_user_id(token: str = Depends(oauth2_scheme), db: AsyncSession = Depends(get_db)) -> int:
+    # for routes that only need to know who is calling, tokens carry user_id so no lookup is needed at all
+    try:
+        user_id = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM]).get("user_id")
+    except jwt.PyJWTError:
+        user_id = None
+    if user_id is not None:
+        return user_id
+    # tokens issued before the claim existed
+    return (await get_current_user(token=token, db=db)).user_id
 
 
 @app.post("/token", tags=['Jwt'] , response_model=Token)
-async def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(get_db)):
+async def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends(), db: AsyncSession = Depends(get_db)):
     user = await crud.get_user_by_username(db, form_data.username.lower())
-    if not user or not verify_password(form_data.password, user.password_hash):
+    if not user or not await passwords.verify_password(form_data.password, user.password_hash):
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Incorrect username or password",
@@ -100,7 +158,7 @@ async def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends(
 
     access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
     access_token = create_access_token(
-        data={"sub": user.username}, expires_delta=access_token_expires
+        data={"sub": user.username, "user_id": user.user_id}, expires_delta=access_token_expires
     )
     return {"access_token": access_token, "token_type": "bearer"}
 
@@ -111,14 +169,15 @@ async def read_users_me(current_user: UserSchema = Depends(get_current_user)):
 
 
 @app.post("/login", tags=['User'], status_code=status.HTTP_200_OK, response_model=UserLoginResponse | ErrorOccured)
-async def login(login_schema: UserLoginSchema, response: Response, db: Session = Depends(get_db)):
+async def login(login_schema: UserLoginSchema, response: Response, db: AsyncSession = Depends(get_db)):
     try:
         user = await crud.get_user_by_username(db, login_schema.username.lower())
         if user is None:
             raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="User not exists")
-        if bcrypt.checkpw(login_schema.password_hash.encode('utf-8'), user.password_hash.encode('utf-8')):
-            await crud.update_user_last_login(db, user.user_id)
-            return user
+        if await passwords.verify_password(login_schema.password_hash, user.password_hash):
+            logged_in_at = crud.update_user_last_login(user.user_id)
+            return UserLoginResponse.model_validate(user, from_attributes=True).model_copy(
+                update={"last_login": logged_in_at})
         else:
             raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Incorrect username or password")
     except HTTPException as e:
@@ -129,9 +188,16 @@ async def login(login_schema: UserLoginSchema, response: Response, db: Session =
         return {"message": f"An error occurred: {e}"}
 
 
-@app.get("/users/get_user_by_id", tags=['User'], status_code=status.HTTP_200_OK)
-async def get_user_by_id(id: int, response: Response, db: Session = Depends(get_db)):
+@app.get("/users/get_user_by_id", tags=['User'], status_code=status.HTTP_200_OK, response_model=UserSchema | None | ErrorOccured)
+async def get_user_by_id(id: int, response: Response, if_none_match: str | None = etags.IfNoneMatchHeader,
+                         db: AsyncSession = Depends(get_db)):
     try:
+        version = await crud.get_user_version(db, id)
+        if version is not None:
+            etag = etags.make_etag("user", id, version)
+            if etags.matches(if_none_match, etag):
+                return etags.not_modified(etag)
+            etags.set_etag(response, etag)
         user = await crud.get_user_by_id(db, id)
         return user
 
@@ -140,8 +206,9 @@ async def get_user_by_id(id: int, response: Response, db: Session = Depends(get_
         return {"message": f"An error occured: {e}"}
 
 
-@app.get("/users/get_user_by_username", tags=['User'], status_code=status.HTTP_200_OK)
-async def get_user_by_username(username: str, response: Response, db: Session = Depends(get_db)):
+@app.get("/users/get_user_by_username", tags=['User'], status_code=status.HTTP_200_OK,
+         response_model=UserSchema | None | ErrorOccured)
+async def get_user_by_username(username: str, response: Response, db: AsyncSession = Depends(get_db)):
     try:
         user = await crud.get_user_by_username(db, username)
         return user
@@ -151,23 +218,38 @@ async def get_user_by_username(username: str, response: Response, db: Session =
         return {"message": f"An error occured: {e}"}
 
 
-@app.get("/users/get_all_active_users", tags=['User'], status_code=status.HTTP_200_OK)
-async def get_all_active_users(response: Response, db: Session = Depends(get_db), current_user: UserSchema = Depends(get_current_user)):
+@app.get("/users/get_all_active_users", tags=['User'], status_code=status.HTTP_200_OK,
+         response_model=list[UserSchema] | ErrorOccured)
+async def get_all_active_users(response: Response, after: str | None = CursorQuery, limit: int = LimitQuery,
+                               stream: bool = False, db: AsyncSession = Depends(get_db),
+                               current_user_id: int = Depends(get_current_user_id)):
     try:
-        active_users = await crud.get_all_active_users(db)
+        if stream:
+            return pagination.ndjson_response(crud.stream_all_active_users, UserSchema)
+        active_users = await crud.get_all_active_users(db, after=pagination.decode_cursor(after), limit=limit)
+        pagination.set_next_cursor(response, active_users, limit, lambda user: (user.user_id,))
         return active_users
     except Exception as e:
         response.status_code = status.HTTP_500_INTERNAL_SERVER_ERROR
         return {"message": f"An error occurred: {e}"}
 
 
-@app.get("/users/get_all_user_friends", tags=['User'], status_code=status.HTTP_200_OK)
-async def get_all_user_friends(user_id: int, response: Response, db: Session = Depends(get_db)):
+@app.get("/users/get_all_user_friends", tags=['User'], status_code=status.HTTP_200_OK,
+         response_model=list[UserSchema] | ErrorOccured)
+async def get_all_user_friends(user_id: int, response: Response, if_none_match: str | None = etags.IfNoneMatchHeader,
+                               db: AsyncSession = Depends(get_db)):
     try:
+        version = await crud.get_friends_version(db, user_id)
+        if version is not None:
+            etag = etags.make_etag("friends", user_id, version)
+            if etags.matches(if_none_match, etag):
+                return etags.not_modified(etag)
         user = await crud.get_user_by_id(db, user_id)
         if user:
             user_friends = await crud.get_all_friends_of_user_by_user_id(db, user_id)
             if user_friends:
+                if version is not None:
+                    etags.set_etag(response, etag)
                 return user_friends
             response.status_code = status.HTTP_404_NOT_FOUND
             return {"message": "You don't have any friends!"}
@@ -177,9 +259,9 @@ async def get_all_user_friends(user_id: int, response: Response, db: Session = D
         return {"message": f"An error occurred: {e}"}
 
 
-@app.post("/users/create_user", tags=['User'], status_code=status.HTTP_201_CREATED)
+@app.post("/users/create_user", tags=['User'], status_code=status.HTTP_201_CREATED, response_model=UserSchema | None | ErrorOccured)
 async def create_user(response: Response, username: str, email: str, password_hash: str, birthday: date,
-                      is_active: bool = True, db: Session = Depends(get_db), current_user: UserSchema = Depends(get_current_user)):
+                      is_active: bool = True, db: AsyncSession = Depends(get_db), current_user: UserSchema = Depends(get_current_user)):
     try:
         new_user = await crud.create_user(db, username, email, password_hash, birthday, is_active)
         return new_user
@@ -188,8 +270,8 @@ async def create_user(response: Response, username: str, email: str, password_ha
         return {"message": f"An error occurred: {e}"}
 
 
-@app.put("/users/update_birthday", tags=['User'], status_code=status.HTTP_200_OK)
-async def update_user_birthday(user_id: int, new_birthday: date, response: Response, db: Session = Depends(get_db), current_user: UserSchema = Depends(get_current_user)):
+@app.put("/users/update_birthday", tags=['User'], status_code=status.HTTP_200_OK, response_model=UserSchema | None | ErrorOccured)
+async def update_user_birthday(user_id: int, new_birthday: date, response: Response, db: AsyncSession = Depends(get_db), current_user: UserSchema = Depends(get_current_user)):
     try:
         updated_user = await crud.update_user_birthday(db, user_id, new_birthday)
         if updated_user:
@@ -200,7 +282,7 @@ async def update_user_birthday(user_id: int, new_birthday: date, response: Respo
 
 
 # @app.put("/users/{user_id}/change_password", tags=['User'], status_code=status.HTTP_200_OK)
-# async def change_user_password(user_id: int, new_password_hash: str, response: Response, db: Session = Depends(get_db), current_user: UserSchema = Depends(get_current_user)):
+# async def change_user_password(user_id: int, new_password_hash: str, response: Response, db: AsyncSession = Depends(get_db), current_user: UserSchema = Depends(get_current_user)):
 #     try:
 #         updated_user = await crud.change_user_password(db, user_id, new_password_hash)
 #         if updated_user:
@@ -210,8 +292,8 @@ async def update_user_birthday(user_id: int, new_birthday: date, response: Respo
 #         return {"message": f"An error occurred: {e}"}
 
 
-@app.put("/users/change_email", tags=['User'], status_code=status.HTTP_200_OK)
-async def change_user_email(user_id: int, new_email: str, response: Response, db: Session = Depends(get_db), current_user: UserSchema = Depends(get_current_user)):
+@app.put("/users/change_email", tags=['User'], status_code=status.HTTP_200_OK, response_model=UserSchema | None | ErrorOccured)
+async def change_user_email(user_id: int, new_email: str, response: Response, db: AsyncSession = Depends(get_db), current_user: UserSchema = Depends(get_current_user)):
     try:
         updated_user = await crud.change_user_email(db, user_id, new_email)
         if updated_user:
@@ -221,8 +303,8 @@ async def change_user_email(user_id: int, new_email: str, response: Response, db
         return {"message": f"An error occurred: {e}"}
 
 
-@app.put("/users/change_username", tags=['User'], status_code=status.HTTP_200_OK)
-async def change_user_username(user_id: int, new_username: str, response: Response, db: Session = Depends(get_db), current_user: UserSchema = Depends(get_current_user)):
+@app.put("/users/change_username", tags=['User'], status_code=status.HTTP_200_OK, response_model=UserSchema | None | ErrorOccured)
+async def change_user_username(user_id: int, new_username: str, response: Response, db: AsyncSession = Depends(get_db), current_user: UserSchema = Depends(get_current_user)):
     try:
         updated_user = await crud.change_user_username(db, user_id, new_username)
         if updated_user:
@@ -232,11 +314,11 @@ async def change_user_username(user_id: int, new_username: str, response: Respon
         return {"message": f"An error occurred: {e}"}
 
 
-@app.put("/users/change_password", tags=['User'], status_code=status.HTTP_200_OK)
-async def change_password(user_id: int, password: str, response: Response, db: Session = Depends(get_db)):
+@app.put("/users/change_password", tags=['User'], status_code=status.HTTP_200_OK, response_model=UserSchema | None | ErrorOccured)
+async def change_password(user_id: int, password: str, response: Response, db: AsyncSession = Depends(get_db)):
     try:
-        hashed_password = bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt(rounds=8))
-        user = await crud.change_password(db, user_id, hashed_password.decode('utf-8'))
+        hashed_password = await passwords.hash_password(password)
+        user = await crud.change_password(db, user_id, hashed_password)
         return user
     except Exception as e:
         response.status_code = status.HTTP_500_INTERNAL_SERVER_ERROR
@@ -245,7 +327,7 @@ async def change_password(user_id: int, password: str, response: Response, db: S
 
 @app.post("/register", tags=['User'], status_code=status.HTTP_201_CREATED,
           response_model=UserRegisterResponse | ErrorOccured)
-async def register(user: UserRegisterSchema, response: Response, db: Session = Depends(get_db)):
+async def register(user: UserRegisterSchema, response: Response, db: AsyncSession = Depends(get_db)):
     try:
         existing_user = await crud.get_user_by_username(db, user.username.lower())
 
@@ -258,10 +340,10 @@ async def register(user: UserRegisterSchema, response: Response, db: Session = D
         if user.birthday > time_now:
             raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Birthday cannot be in the future")
 
-        hashed_password = bcrypt.hashpw(user.password.encode('utf-8'), bcrypt.gensalt(rounds=8))
+        hashed_password = await passwords.hash_password(user.password)
 
         new_user = await crud.create_user(db, username=user.username.lower(), email=user.email,
-                                          password_hash=hashed_password.decode('utf-8'), birthday=user.birthday)
+                                          password_hash=hashed_password, birthday=user.birthday)
 
         if new_user is None:
             raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
@@ -276,10 +358,16 @@ async def register(user: UserRegisterSchema, response: Response, db: Session = D
         return {"message": f"An error occurred: {e}"}
 
 
-@app.get("/event/get_all_participants", tags=['EventParticipants'], status_code=status.HTTP_200_OK)
-async def get_all_participants(response: Response, db: Session = Depends(get_db)):
+@app.get("/event/get_all_participants", tags=['EventParticipants'], status_code=status.HTTP_200_OK,
+         response_model=list[EventParticipantSchema] | ErrorOccured)
+async def get_all_participants(response: Response, after: str | None = CursorQuery, limit: int = LimitQuery,
+                               stream: bool = False, db: AsyncSession = Depends(get_db)):
     try:
-        participants = await crud.get_all_participants(db)
+        if stream:
+            return pagination.ndjson_response(crud.stream_all_participants, EventParticipantSchema)
+        participants = await crud.get_all_participants(db, after=pagination.decode_cursor(after), limit=limit)
+        pagination.set_next_cursor(response, participants, limit,
+                                   lambda participant: (participant.event_id, participant.user_id))
 
         return participants
 
@@ -288,28 +376,106 @@ async def get_all_participants(response: Response, db: Session = Depends(get_db)
         return {"message": f"An error occurred: {e}"}
 
 
-@app.get("/event", tags=['Event'], status_code=status.HTTP_200_OK)
-async def get_event_by_id(event_id, response: Response, db: Session = Depends(get_db)):
+@app.get("/event", tags=['Event'], status_code=status.HTTP_200_OK, response_model=EventSchema | None | ErrorOccured)
+async def get_event_by_id(event_id: int, response: Response, if_none_match: str | None = etags.IfNoneMatchHeader,
+                         db: AsyncSession = Depends(get_db)):
     try:
+        version = await crud.get_event_version(event_id=event_id, db=db)
+        if version is not None:
+            etag = etags.make_etag("event", event_id, version)
+            if etags.matches(if_none_match, etag):
+                return etags.not_modified(etag)
         event = await crud.get_event_by_id(event_id=event_id, db=db)
+        if event is not None and version is not None:
+            etags.set_etag(response, etag)
         return event
     except Exception as e:
         response.status_code = 500
         return {"message": f"An error occurred: {e}"}
 
 
-@app.get("/events/get_user_events", tags=['Event'], status_code=status.HTTP_200_OK)
-async def get_all_events_of_user_by_user_id(user_id: int, response: Response, db: Session = Depends(get_db)):
+@app.get("/events/get_user_events", tags=['Event'], status_code=status.HTTP_200_OK,
+         response_model=list[EventSchema] | ErrorOccured)
+async def get_all_events_of_user_by_user_id(user_id: int, response: Response, after: str | None = CursorQuery,
+                                            limit: int = LimitQuery, stream: bool = False,
+                                            if_none_match: str | None = etags.IfNoneMatchHeader,
+                                            db: AsyncSession = Depends(get_db)):
     try:
-        events = await crud.get_all_events_of_user_by_user_id(user_id=user_id, db=db)
+        if stream:
+            return pagination.ndjson_response(
+                lambda stream_db: crud.stream_all_events_of_user_by_user_id(user_id=user_id, db=stream_db), EventSchema)
+        version = await crud.get_events_of_user_version(user_id=user_id, db=db)
+        if version is not None:
+            etag = etags.make_etag("user_events", user_id, version, after, limit)
+            if etags.matches(if_none_match, etag):
+                return etags.not_modified(etag)
+            etags.set_etag(response, etag)
+        events = await crud.get_all_events_of_user_by_user_id(user_id=user_id, db=db,
+                                                              after=pagination.decode_cursor(after), limit=limit)
+        pagination.set_next_cursor(response, events, limit, lambda event: (event.event_id,))
         return events
     except Exception as e:
         response.status_code = 500
         return {"message": f"An error occurred: {e}"}
 
 
-@app.get("/event/crated_by", tags=['Event'], status_code=status.HTTP_200_OK)
-async def get_all_events_by_creator_id(user_id: int, response: Response, db: Session = Depends(get_db)):
+@app.get("/events/sync", tags=['Event'], status_code=status.HTTP_200_OK,
+         response_model=EventSyncSchema | ErrorOccured)
+async def sync_events_of_user(user_id: int, response: Response, cursor: int | None = Query(None, ge=0),
+                              limit: int = LimitQuery, db: AsyncSession = Depends(get_db)):
+    try:
+        if cursor is None:
+            # no cursor yet: take the current one, then load everything with /events/get_user_events
+            return {"cursor": await crud.get_latest_change_id(db), "has_more": False, "events": [], "deleted": []}
+        return await crud.get_event_changes_of_user(user_id=user_id, cursor=cursor, limit=limit, db=db)
+    except Exception as e:
+        response.status_code = 500
+        return {"message": f"An error occurred: {e}"}
+
+
+@app.get("/events/export.ics", tags=['Event'], status_code=status.HTTP_200_OK)
+async def export_events_of_user(user_id: int, response: Response, start: datetime | None = None,
+                                end: datetime | None = None):
+    try:
+        if start is not None and end is not None and end <= start:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="End must be after start")
+        return ics.ics_response(
+            lambda stream_db: crud.stream_events_of_user_for_export(user_id=user_id, start=start, end=end,
+                                                                     db=stream_db),
+            filename=f"calendar-{user_id}.ics")
+    except HTTPException as e:
+        response.status_code = e.status_code
+        return {"message": e.detail}
+    except Exception as e:
+        response.status_code = 500
+        return {"message": f"An error occurred: {e}"}
+
+
+@app.post("/events/import", tags=['Event'], status_code=status.HTTP_200_OK,
+          response_model=ImportReportSchema | ErrorOccured)
+async def import_events(user_id: int, file: UploadFile, response: Response,
+                        file_format: Literal["csv", "ics"] | None = None, db: AsyncSession = Depends(get_db)):
+    try:
+        file_format = file_format or importer.format_of(file.filename)
+        if file_format is None:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
+                                detail="Unknown file format, pass file_format=csv or file_format=ics")
+        if await crud.get_user_by_id(db, user_id) is None:
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="User not found")
+        # the upload is already spooled to a temporary file, it's read line by line from there
+        lines = io.TextIOWrapper(file.file, encoding="utf-8-sig", newline="")
+        return await crud.import_events(user_id, importer.parse(file_format, lines), db=db)
+    except HTTPException as e:
+        response.status_code = e.status_code
+        return {"message": e.detail}
+    except Exception as e:
+        response.status_code = 500
+        return {"message": f"An error occurred: {e}"}
+
+
+@app.get("/event/crated_by", tags=['Event'], status_code=status.HTTP_200_OK,
+         response_model=list[EventSchema] | ErrorOccured)
+async def get_all_events_by_creator_id(user_id: int, response: Response, db: AsyncSession = Depends(get_db)):
     try:
         events = await crud.get_all_events_by_creator_id(user_id=user_id, db=db)
         return events
@@ -318,8 +484,9 @@ async def get_all_events_by_creator_id(user_id: int, response: Response, db: Ses
         return {"message": f"An error occurred: {e}"}
 
 
-@app.get("/event/participants", tags=['Event'], status_code=status.HTTP_200_OK)
-async def get_all_event_participants(event_id: int, response: Response, db: Session = Depends(get_db)):
+@app.get("/event/participants", tags=['Event'], status_code=status.HTTP_200_OK,
+         response_model=list[UserSchema] | ErrorOccured)
+async def get_all_event_participants(event_id: int, response: Response, db: AsyncSession = Depends(get_db)):
     try:
         events = await crud.get_all_event_participants(event_id=event_id, db=db)
         return events
@@ -328,10 +495,11 @@ async def get_all_event_participants(event_id: int, response: Response, db: Sess
         return {"message": f"An error occurred: {e}"}
 
 
-@app.get("/events/range_of_time", tags=['Event'], status_code=status.HTTP_200_OK)
+@app.get("/events/range_of_time", tags=['Event'], status_code=status.HTTP_200_OK,
+         response_model=list[EventOccurrenceSchema] | ErrorOccured)
 async def get_all_events_by_user_id_ongoing_in_specified_time(user_id: int, start: datetime,
                                                               end: datetime, response: Response,
-                                                              db: Session = Depends(get_db)):
+                                                              db: AsyncSession = Depends(get_db)):
     try:
         events = await crud.get_all_events_by_user_id_ongoing_in_specified_time(user_id=user_id, start=start, end=end,
                                                                                 db=db)
@@ -341,11 +509,44 @@ async def get_all_events_by_user_id_ongoing_in_specified_time(user_id: int, star
         return {"message": f"An error occurred: {e}"}
 
 
+@app.get("/availability", tags=['Availability'], status_code=status.HTTP_200_OK,
+         response_model=list[TimeSlotSchema] | ErrorOccured)
+async def get_common_availability(start: datetime, end: datetime, response: Response,
+                                  user_ids: list[int] = Query(...),
+                                  slot_minutes: int = Query(availability.DEFAULT_SLOT_MINUTES, ge=1, le=1440),
+                                  db: AsyncSession = Depends(get_db)):
+    try:
+        if end <= start:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="End must be after start")
+        slot = timedelta(minutes=slot_minutes)
+        if end - start > availability.MAX_WINDOW:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Time window is too long")
+        if availability.slot_count(availability.align(start, slot), end, slot) > availability.MAX_SLOTS:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
+                                detail=f"Time window has more than {availability.MAX_SLOTS} slots, use longer slots")
+        if len(set(user_ids)) > availability.MAX_USERS:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
+                                detail=f"At most {availability.MAX_USERS} users can be compared")
+        free_slots = await availability.common_free_slots(
+            user_ids, start, end, slot,
+            load_periods=lambda missing, window_start, window_end: crud.get_busy_periods_of_users(
+                missing, start=window_start, end=window_end, db=db))
+        return [{"start": slot_start, "end": slot_end} for slot_start, slot_end in free_slots]
+    except HTTPException as e:
+        response.status_code = e.status_code
+        return {"message": e.detail}
+    except Exception as e:
+        response.status_code = 500
+        return {"message": f"An error occurred: {e}"}
+
+
 @app.post("/event/create", tags=['Event'], status_code=status.HTTP_201_CREATED)
 async def create_event_with_required_associations(event: EventRequest, response: Response,
-                                                  db: Session = Depends(get_db)):
+                                                  check_conflicts: bool = False, db: AsyncSession = Depends(get_db)):
     try:
-        await crud.create_event_with_required_associations(event=event, db=db)
+        db_event = await crud.create_event_with_required_associations(event=event, db=db)
+        if check_conflicts:
+            return {"message": "created successfully", "conflicts": await crud.get_event_conflicts(db_event, db=db)}
         return {"message": "created successfully"}
     except Exception as e:
         response.status_code = 500
@@ -353,7 +554,7 @@ async def create_event_with_required_associations(event: EventRequest, response:
 
 
 @app.post("/category/create", tags=['Category'], status_code=status.HTTP_201_CREATED)
-async def create_category(category: CategoryRequest, response: Response, db: Session = Depends(get_db)):
+async def create_category(category: CategoryRequest, response: Response, db: AsyncSession = Depends(get_db)):
     try:
         await crud.create_category(category=category, db=db)
         return {"message": "created successfully"}
@@ -364,9 +565,11 @@ async def create_category(category: CategoryRequest, response: Response, db: Ses
 
 @app.put("/event/update", tags=['Event'], status_code=status.HTTP_200_OK)
 async def update_event(event_id: int, changed_data: EventRequest, response: Response,
-                       db: Session = Depends(get_db)):
+                       check_conflicts: bool = False, db: AsyncSession = Depends(get_db)):
     try:
-        await crud.update_event(event_id=event_id, changed_data=changed_data, db=db)
+        event = await crud.update_event(event_id=event_id, changed_data=changed_data, db=db)
+        if check_conflicts:
+            return {"message": "updated successfully", "conflicts": await crud.get_event_conflicts(event, db=db)}
         return {"message": "updated successfully"}
     except Exception as e:
         response.status_code = 500
@@ -375,7 +578,7 @@ async def update_event(event_id: int, changed_data: EventRequest, response: Resp
 
 @app.put("/category/update", tags=['Category'], status_code=status.HTTP_200_OK)
 async def update_category(category_id: int, changed_data: CategoryRequest, response: Response,
-                          db: Session = Depends(get_db)):
+                          db: AsyncSession = Depends(get_db)):
     try:
         await crud.update_category(category_id=category_id, changed_data=changed_data, db=db)
         return {"message": "updated successfully"}
@@ -386,7 +589,7 @@ async def update_category(category_id: int, changed_data: CategoryRequest, respo
 
 @app.put("/event/participants/accept_or_reject", tags=['EventParticipants'], status_code=status.HTTP_200_OK)
 async def accept_or_reject_participate_in_event(user_id: int, event_id: int, is_accepted: bool, response: Response,
-                                                db: Session = Depends(get_db)):
+                                                db: AsyncSession = Depends(get_db)):
     try:
         res = await crud.accept_or_reject_participate_in_event(user_id=user_id, event_id=event_id,
                                                                 is_accepted=is_accepted, db=db)
@@ -398,7 +601,7 @@ async def accept_or_reject_participate_in_event(user_id: int, event_id: int, is_
 
 @app.delete("/event/delete", tags=['Event'], status_code=status.HTTP_200_OK)
 async def delete_event_and_associated_objects(user_id: int, event_id: int, response: Response,
-                                              db: Session = Depends(get_db)):
+                                              db: AsyncSession = Depends(get_db)):
     try:
         await crud.delete_event_and_associated_objects(user_id=user_id, event_id=event_id, db=db)
         return {"message": "deleted successfully"}
@@ -408,7 +611,7 @@ async def delete_event_and_associated_objects(user_id: int, event_id: int, respo
 
 
 @app.delete("/category/delete", tags=['Category'], status_code=status.HTTP_200_OK)
-async def delete_category(category_id: int, response: Response, db: Session = Depends(get_db)):
+async def delete_category(category_id: int, response: Response, db: AsyncSession = Depends(get_db)):
     try:
         await crud.delete_category(category_id=category_id, db=db)
         return {"message": "deleted successfully"}
@@ -417,8 +620,28 @@ async def delete_category(category_id: int, response: Response, db: Session = De
         return {"message": f"An error occurred: {e}"}
 
 
+@app.get("/friends/suggestions", tags=['Friends'], status_code=status.HTTP_200_OK,
+         response_model=list[FriendSuggestionSchema] | ErrorOccured)
+async def get_friend_suggestions(user_id: int, response: Response,
+                                 limit: int = Query(suggestions.DEFAULT_SUGGESTIONS, ge=1,
+                                                    le=suggestions.MAX_SUGGESTIONS),
+                                 db: AsyncSession = Depends(get_db)):
+    try:
+        friend_suggestions = await crud.get_friend_suggestions(db, user_id, limit)
+        if friend_suggestions is None:
+            raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                                detail="Friend graph is still loading, try again shortly")
+        return friend_suggestions
+    except HTTPException as e:
+        response.status_code = e.status_code
+        return {"message": e.detail}
+    except Exception as e:
+        response.status_code = status.HTTP_500_INTERNAL_SERVER_ERROR
+        return {"message": f"An error occurred: {e}"}
+
+
 @app.put("/friends/reject", tags=['Friends'], status_code=status.HTTP_200_OK, response_model=Friendship|dict)
-async def reject_friend_request(sender_id: int, recipient_id: int, response: Response, db: Session = Depends(get_db)):
+async def reject_friend_request(sender_id: int, recipient_id: int, response: Response, db: AsyncSession = Depends(get_db)):
     try:
         friendship_res = await crud.alter_friend_request(db, sender_id, recipient_id, "rejected")
 
@@ -433,22 +656,19 @@ async def reject_friend_request(sender_id: int, recipient_id: int, response: Res
 
 
 @app.post("/friends/send", tags=['Friends'], status_code=status.HTTP_201_CREATED, response_model=Friendship|dict)
-async def send_friend_request(sender_id: int, recipient_id: int, response: Response, db: Session = Depends(get_db)):
+async def send_friend_request(sender_id: int, recipient_id: int, response: Response, db: AsyncSession = Depends(get_db)):
     try:
         if sender_id == recipient_id:
             raise HTTPException(status_code=409, detail='Cannot send request to self')
 
-        frienship = await crud.get_friend_request(db, sender_id, recipient_id)
-
-        if frienship is None:
-            friendship = await crud.create_friend_request(db, sender_id, recipient_id)
+        friendship = await crud.create_friend_request(db, sender_id, recipient_id)
 
-            if isinstance(friendship, dict) and friendship.get('error', None) is not None:
-                raise HTTPException(status_code=404, detail=friendship['error'])
+        if isinstance(friendship, dict) and friendship.get('error', None) is not None:
+            if friendship['error'] == 'Friend request already sent':
+                raise HTTPException(status_code=409, detail=friendship['error'])
+            raise HTTPException(status_code=404, detail=friendship['error'])
 
-            return friendship
-
-        raise HTTPException(status_code=409, detail='Friend request already sent')
+        return friendship
 
     except HTTPException as e:
         response.status_code = e.status_code
@@ -459,7 +679,7 @@ async def send_friend_request(sender_id: int, recipient_id: int, response: Respo
 
 
 @app.put("/friends/accept", tags=['Friends'], status_code=status.HTTP_200_OK, response_model=Friendship|dict)
-async def accept_friend_request(sender_id: int, recipient_id: int, response: Response, db: Session = Depends(get_db)):
+async def accept_friend_request(sender_id: int, recipient_id: int, response: Response, db: AsyncSession = Depends(get_db)):
     try:
         friendship_res = await crud.alter_friend_request(db, sender_id, recipient_id, "accepted")
 
@@ -474,7 +694,7 @@ async def accept_friend_request(sender_id: int, recipient_id: int, response: Res
 
 
 @app.put("/friends/cancel", tags=['Friends'], status_code=status.HTTP_200_OK, response_model=Friendship|dict)
-async def reject_friend_request(sender_id: int, recipient_id: int, response: Response, db: Session = Depends(get_db)):
+async def reject_friend_request(sender_id: int, recipient_id: int, response: Response, db: AsyncSession = Depends(get_db)):
     try:
         friendship_res = await crud.alter_friend_request(db, sender_id, recipient_id, "cancelled")
 
@@ -486,3 +706,57 @@ async def reject_friend_request(sender_id: int, recipient_id: int, response: Res
     except HTTPException as e:
         response.status_code = e.status_code
         return {"message": e.detail}
+
+
+@app.websocket("/ws/calendar")
+async def calendar_updates(websocket: WebSocket, user_id: int):
+    await websocket.accept()
+    subscriber = notifications.hub.subscribe(user_id, websocket.send_text)
+    try:
+        # clients send nothing, receiving is only how a closed connection is noticed
+        while True:
+            await websocket.receive_text()
+    except WebSocketDisconnect:
+        pass
+    finally:
+        notifications.hub.unsubscribe(user_id, subscriber)
+
+
+@app.get("/metrics", tags=['Stats'], status_code=status.HTTP_200_OK, include_in_schema=False)
+async def get_metrics():
+    return metrics.metrics_response()
+
+
+@app.get("/stats/pool", tags=['Stats'], status_code=status.HTTP_200_OK)
+async def get_pool_stats():
+    return pool_stats()
+
+
+@app.get("/stats/passwords", tags=['Stats'], status_code=status.HTTP_200_OK)
+async def get_password_stats():
+    return passwords.password_stats()
+
+
+@app.get("/stats/user_cache", tags=['Stats'], status_code=status.HTTP_200_OK)
+async def get_user_cache_stats():
+    return user_cache.stats()
+
+
+@app.get("/stats/busy_cache", tags=['Stats'], status_code=status.HTTP_200_OK)
+async def get_busy_cache_stats():
+    return availability.busy_cache.stats()
+
+
+@app.get("/stats/friend_graph", tags=['Stats'], status_code=status.HTTP_200_OK)
+async def get_friend_graph_stats():
+    return friend_graph.friend_graph.stats()
+
+
+@app.get("/stats/last_login", tags=['Stats'], status_code=status.HTTP_200_OK)
+async def get_last_login_stats():
+    return last_login.last_login_buffer.stats()
+
+
+@app.get("/stats/calendar_updates", tags=['Stats'], status_code=status.HTTP_200_OK)
+async def get_calendar_updates_stats():
+    return notifications.hub.stats()
@@ -0,0 +1,113 @@
+import time
+from contextvars import ContextVar
+from typing import Callable
+
+from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY, Counter, Histogram, generate_latest
+from prometheus_client.core import GaugeMetricFamily
+from sqlalchemy import event
+from starlette.responses import Response
+
+from database import _engine
+
+
+REQUEST_LATENCY = Histogram(
+    "http_request_duration_seconds", "Time from receiving the request to sending the last body chunk",
+    ["method", "route"])
+REQUESTS = Counter("http_requests", "Finished requests by status code", ["method", "route", "status"])
+RESPONSE_SIZE = Histogram(
+    "http_response_size_bytes", "Response body size", ["method", "route"],
+    buckets=(256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216))
+SQL_STATEMENTS = Histogram(
+    "http_request_sql_statements", "SQL statements executed while handling a request", ["method", "route"],
+    buckets=(0, 1, 2, 3, 5, 8, 13, 21, 34, 55, 100))
+SQL_TIME = Histogram(
+    "http_request_sql_duration_seconds", "Time spent in SQL statements while handling a request", ["method", "route"])
+SQL_STATEMENTS_OUTSIDE_REQUESTS = Counter(
+    "sql_statements_outside_requests", "SQL statements executed by background jobs")
+
+
+class RequestSql:
+    __slots__ = ("statements", "seconds")
+
+    def __init__(self):
+        self.statements = 0
+        self.seconds = 0.0
+
+
+# set by the middleware for the duration of a request, sqlalchemy runs the events in the same context
+_request_sql: ContextVar[RequestSql | None] = ContextVar("request_sql", default=None)
+
+
+@event.listens_for(_engine.sync_engine, "before_cursor_execute")
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+
+@event.listens_for(_engine.sync_engine, "after_cursor_execute")
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - conn.info["query_start"].pop()
+    request_sql = _request_sql.get()
+    if request_sql is None:
+        SQL_STATEMENTS_OUTSIDE_REQUESTS.inc()
+        return
+    request_sql.statements += 1
+    request_sql.seconds += elapsed
+
+
+class MetricsMiddleware:
+    # plain asgi middleware, it only wraps send, so streaming responses keep streaming
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        start = time.perf_counter()
+        request_sql = RequestSql()
+        token = _request_sql.set(request_sql)
+        status_code = 500
+        body_size = 0
+
+        async def send_and_measure(message):
+            nonlocal status_code, body_size
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            elif message["type"] == "http.response.body":
+                body_size += len(message.get("body", b""))
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_and_measure)
+        finally:
+            _request_sql.reset(token)
+            # the route template keeps the label set bounded, the raw path would not
+            route = scope.get("route")
+            route = route.path if route is not None else "unmatched"
+            method = scope["method"]
+            REQUEST_LATENCY.labels(method, route).observe(time.perf_counter() - start)
+            REQUESTS.labels(method, route, str(status_code)).inc()
+            RESPONSE_SIZE.labels(method, route).observe(body_size)
+            SQL_STATEMENTS.labels(method, route).observe(request_sql.statements)
+            SQL_TIME.labels(method, route).observe(request_sql.seconds)
+
+
+class StatsCollector:
+    # exposes the numeric values of the existing stats() dicts as gauges, read at scrape time
+    def __init__(self, sources: dict[str, Callable[[], dict]]):
+        self.sources = sources
+
+    def collect(self):
+        for prefix, stats in self.sources.items():
+            for key, value in stats().items():
+                if isinstance(value, (bool, int, float)):
+                    yield GaugeMetricFamily(f"{prefix}_{key}", f"{prefix} {key}".replace("_", " "), value=float(value))
+
+
+def register_stats(sources: dict[str, Callable[[], dict]]):
+    REGISTRY.register(StatsCollector(sources))
+
+
+def metrics_response() -> Response:
+    return Response(generate_latest(REGISTRY), media_type=CONTENT_TYPE_LATEST)
@@ -0,0 +1,68 @@
+"""add db_event_occurrence with its period index, foreign key and lookup indexes
+
+Revision ID: 0001
+Revises:
+Create Date: 2026-10-18 12:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0001'
+down_revision: Union[str, None] = None
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+INDEXES = [
+    # name, table, columns, unique
+    ('ix_db_event_created_by', 'db_event', ['created_by'], False),
+    ('ix_db_event_participants_user_id', 'db_event_participants', ['user_id'], False),
+    ('ix_db_event_category_category_id', 'db_event_category', ['category_id'], False),
+    # (user1_id, user2_id) serves both get_friend_request and the user1_id branch of the friends union
+    ('ix_db_user_friendship_user1_id_user2_id', 'db_user_friendship', ['user1_id', 'user2_id'], False),
+    ('ix_db_user_friendship_user2_id', 'db_user_friendship', ['user2_id'], False),
+    # init.sql only has UNIQUE(username, email), which can't serve lookups by username alone
+    ('uq_db_user_username', 'db_user', ['username'], True),
+]
+
+
+# IF NOT EXISTS because databases created before the table moved here got it from init.sql
+OCCURRENCE_DDL = [
+    # btree_gist lets event_id share a gist index with the occurrence period
+    "CREATE EXTENSION IF NOT EXISTS btree_gist",
+    """
+    CREATE TABLE IF NOT EXISTS db_event_occurrence(
+        event_id int NOT NULL,
+        occurrence_index int NOT NULL,
+        occurrence_start timestamp NOT NULL,
+        occurrence_end timestamp NOT NULL,
+        PRIMARY KEY(event_id, occurrence_index),
+
+        CONSTRAINT fk_event_for_occurrence FOREIGN KEY(event_id) REFERENCES db_event(event_id)
+    )
+    """,
+    # occurrences.overlapping builds the same tsrange(occurrence_start, occurrence_end, '[]') expression
+    "CREATE INDEX IF NOT EXISTS idx_event_occurrence_period ON db_event_occurrence "
+    "USING gist (event_id, tsrange(occurrence_start, occurrence_end, '[]'))",
+]
+
+
+def upgrade() -> None:
+    for statement in OCCURRENCE_DDL:
+        op.execute(statement)
+    # CREATE INDEX CONCURRENTLY doesn't lock writes but can't run inside a transaction
+    with op.get_context().autocommit_block():
+        for name, table, columns, unique in INDEXES:
+            op.create_index(name, table, columns, unique=unique, postgresql_concurrently=True, if_not_exists=True)
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        for name, table, columns, unique in reversed(INDEXES):
+            op.drop_index(name, table_name=table, postgresql_concurrently=True, if_exists=True)
+    op.execute("DROP TABLE IF EXISTS db_event_occurrence")
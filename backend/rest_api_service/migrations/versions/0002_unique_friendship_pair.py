@@ -0,0 +1,41 @@
+"""make (user1_id, user2_id) unique on db_user_friendship
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2026-10-18 12:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0002'
+down_revision: Union[str, None] = '0001'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # requests raced past the old SELECT pre-check could leave duplicates, the latest row of a pair wins
+    op.execute(
+        "DELETE FROM db_user_friendship AS older USING db_user_friendship AS newer "
+        "WHERE older.user1_id = newer.user1_id AND older.user2_id = newer.user2_id "
+        "AND older.friendship_id < newer.friendship_id"
+    )
+    # the unique index serves every lookup the plain one did, so it replaces it
+    with op.get_context().autocommit_block():
+        op.create_index('uq_db_user_friendship_user1_id_user2_id', 'db_user_friendship', ['user1_id', 'user2_id'],
+                        unique=True, postgresql_concurrently=True, if_not_exists=True)
+        op.drop_index('ix_db_user_friendship_user1_id_user2_id', table_name='db_user_friendship',
+                      postgresql_concurrently=True, if_exists=True)
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.create_index('ix_db_user_friendship_user1_id_user2_id', 'db_user_friendship', ['user1_id', 'user2_id'],
+                        postgresql_concurrently=True, if_not_exists=True)
+        op.drop_index('uq_db_user_friendship_user1_id_user2_id', table_name='db_user_friendship',
+                      postgresql_concurrently=True, if_exists=True)
@@ -0,0 +1,36 @@
+"""add db_event_change, the per-user log of event changes behind /events/sync
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2026-10-18 12:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0003'
+down_revision: Union[str, None] = '0002'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # no foreign keys, tombstones outlive the event and the participation they describe
+    op.create_table(
+        'db_event_change',
+        sa.Column('change_id', sa.BigInteger(), sa.Identity(), primary_key=True),
+        sa.Column('user_id', sa.Integer(), nullable=False),
+        sa.Column('event_id', sa.Integer(), nullable=False),
+        sa.Column('deleted', sa.Boolean(), nullable=False),
+        sa.Column('changed_at', sa.TIMESTAMP(), nullable=False, server_default=sa.func.now()),
+    )
+    op.create_index('ix_db_event_change_user_id_change_id', 'db_event_change', ['user_id', 'change_id'])
+
+
+def downgrade() -> None:
+    op.drop_index('ix_db_event_change_user_id_change_id', table_name='db_event_change')
+    op.drop_table('db_event_change')
@@ -0,0 +1,33 @@
+"""add db_user.version and the event lookup of db_event_change, both back the ETags of read endpoints
+
+Revision ID: 0004
+Revises: 0003
+Create Date: 2026-10-18 12:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0004'
+down_revision: Union[str, None] = '0003'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # a constant default doesn't rewrite the table
+    op.add_column('db_user', sa.Column('version', sa.Integer(), nullable=False, server_default='1'))
+    with op.get_context().autocommit_block():
+        op.create_index('ix_db_event_change_event_id_change_id', 'db_event_change', ['event_id', 'change_id'],
+                        postgresql_concurrently=True, if_not_exists=True)
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.drop_index('ix_db_event_change_event_id_change_id', table_name='db_event_change',
+                      postgresql_concurrently=True, if_exists=True)
+    op.drop_column('db_user', 'version')
@@ -1,7 +1,7 @@
 import json
 from pydantic import BaseModel
 from database import Base
-from sqlalchemy import Column, Integer, String, Boolean, ForeignKey, TIMESTAMP, Date, Table, Sequence
+from sqlalchemy import Column, Identity, Integer, BigInteger, String, Boolean, ForeignKey, TIMESTAMP, Date, Table, Sequence, Index, text
 from sqlalchemy.orm import relationship
 from sqlalchemy.dialects.postgresql import ENUM
 from datetime import datetime, timezone, timedelta
@@ -59,6 +59,8 @@ class DBUser(Base):
     last_login = Column(TIMESTAMP, nullable=False)
     update_date = Column(TIMESTAMP, nullable=False, onupdate=lambda: datetime.now(timezone.utc))
     is_active = Column(Boolean, nullable=False)
+    # bumped by every UPDATE of the row, ORM or core, read as the ETag version of the user
+    version = Column(Integer, nullable=False, server_default=text("1"), onupdate=text("version + 1"))
 
     events_created = relationship("DBEvent", back_populates="creator")
     participated_events = relationship("DBEventParticipants", back_populates="user")
@@ -89,7 +91,7 @@ class DBEvent(Base):
     __tablename__ = 'db_event'
 
     event_id = Column(Integer, Sequence('db_event_id_seq'), primary_key=True)
-    created_by = Column(Integer, ForeignKey('db_user.user_id'), nullable=False)
+    created_by = Column(Integer, ForeignKey('db_user.user_id'), nullable=False, index=True)
     event_name = Column(String(60), nullable=False)
     event_description = Column(String(255))
     event_date_start = Column(TIMESTAMP, nullable=False)
@@ -173,21 +175,49 @@ class DBEventCategory(Base):
     __tablename__ = 'db_event_category'
 
     event_id = Column(Integer, ForeignKey('db_event.event_id'), primary_key=True)
-    category_id = Column(Integer, ForeignKey('db_category.category_id'), primary_key=True)
+    category_id = Column(Integer, ForeignKey('db_category.category_id'), primary_key=True, index=True)
 
     def __init__(self, event_id, category_id):
         self.event_id = event_id
         self.category_id = category_id
 
 
+class DBEventOccurrence(Base):
+    __tablename__ = 'db_event_occurrence'
+
+    event_id = Column(Integer, ForeignKey('db_event.event_id'), primary_key=True)
+    occurrence_index = Column(Integer, primary_key=True)
+    occurrence_start = Column(TIMESTAMP, nullable=False)
+    occurrence_end = Column(TIMESTAMP, nullable=False)
+
+
+class DBEventChange(Base):
+    # one row per user whose view of an event changed, change_id is the sync cursor
+    __tablename__ = 'db_event_change'
+    __table_args__ = (
+        Index('ix_db_event_change_user_id_change_id', 'user_id', 'change_id'),
+        Index('ix_db_event_change_event_id_change_id', 'event_id', 'change_id'),
+    )
+
+    change_id = Column(BigInteger, Identity(), primary_key=True)
+    user_id = Column(Integer, nullable=False)
+    event_id = Column(Integer, nullable=False)
+    deleted = Column(Boolean, nullable=False)
+    changed_at = Column(TIMESTAMP, nullable=False, default=datetime.now)
+
+
 class DBUserFriendship(Base):
     __tablename__ = 'db_user_friendship'
+    __table_args__ = (
+        Index('uq_db_user_friendship_user1_id_user2_id', 'user1_id', 'user2_id', unique=True),
+        Index('ix_db_user_friendship_user2_id', 'user2_id'),
+    )
 
     friendship_id = Column(Integer, primary_key=True)
     user1_id = Column(Integer, ForeignKey('db_user.user_id'), nullable=False)
     user2_id = Column(Integer, ForeignKey('db_user.user_id'), nullable=False)
     friendship_status = Column(status, nullable=False)
-    sent_at = Column(TIMESTAMP, nullable=False, default=datetime.now())
+    sent_at = Column(TIMESTAMP, nullable=False, default=datetime.now)
     action_time = Column(TIMESTAMP, nullable=True)
 
 
@@ -195,7 +225,7 @@ class DBEventParticipants(Base):
     __tablename__ = 'db_event_participants'
 
     event_id = Column(Integer, ForeignKey('db_event.event_id'), primary_key=True)
-    user_id = Column(Integer, ForeignKey('db_user.user_id'), primary_key=True)
+    user_id = Column(Integer, ForeignKey('db_user.user_id'), primary_key=True, index=True)
     participant_status = Column(status, nullable=False)
     participant_role = Column(event_role, nullable=False)
     response_time = Column(TIMESTAMP, nullable=False)
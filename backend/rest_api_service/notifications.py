@@ -0,0 +1,139 @@
+import asyncio
+from collections import deque
+from typing import Awaitable, Callable, Iterable
+
+import asyncpg
+import orjson
+from sqlalchemy import func, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+import availability
+from database import DATABASE_URL
+
+
+CHANNEL = "calendar_updates"
+# NOTIFY payloads are capped at 8000 bytes, bigger fan-outs are split
+USER_IDS_PER_NOTIFY = 500
+# messages queued for a client that doesn't keep up, older ones are dropped first
+MAX_PENDING_PER_CONNECTION = 100
+LISTENER_PING_SECONDS = 30
+RECONNECT_SECONDS = 5
+# messages about writes that move someone's busy periods, every worker drops those users' cached bitmaps
+BUSY_CHANGING_MESSAGES = {"event_changed", "event_removed", "events_imported"}
+
+# asyncpg takes the plain postgresql:// form
+LISTEN_DSN = DATABASE_URL.set(drivername="postgresql").render_as_string(hide_password=False)
+
+
+class Subscriber:
+    # an idle connection is only this object, a sending task exists while messages are queued
+    __slots__ = ("hub", "send", "pending", "sending")
+
+    def __init__(self, hub: "Hub", send: Callable[[str], Awaitable[None]]):
+        self.hub = hub
+        self.send = send
+        self.pending: deque[str] = deque()
+        self.sending: asyncio.Task | None = None
+
+    def push(self, message: str):
+        if len(self.pending) >= MAX_PENDING_PER_CONNECTION:
+            self.pending.popleft()
+            self.hub.dropped += 1
+        self.pending.append(message)
+        if self.sending is None:
+            self.sending = asyncio.create_task(self._drain())
+
+    async def _drain(self):
+        try:
+            while self.pending:
+                await self.send(self.pending.popleft())
+                self.hub.delivered += 1
+        except Exception:
+            # the connection is gone, its receive loop unsubscribes it
+            self.pending.clear()
+        finally:
+            self.sending = None
+
+
+class Hub:
+    # per process, every worker receives every notification through LISTEN and delivers to its own connections
+    def __init__(self):
+        self._subscribers: dict[int, set[Subscriber]] = {}
+        self.connections = 0
+        self.notifications = 0
+        self.delivered = 0
+        self.dropped = 0
+        self.listening = False
+
+    def subscribe(self, user_id: int, send: Callable[[str], Awaitable[None]]) -> Subscriber:
+        subscriber = Subscriber(self, send)
+        self._subscribers.setdefault(user_id, set()).add(subscriber)
+        self.connections += 1
+        return subscriber
+
+    def unsubscribe(self, user_id: int, subscriber: Subscriber):
+        subscribers = self._subscribers.get(user_id)
+        if subscribers is None or subscriber not in subscribers:
+            return
+        subscribers.discard(subscriber)
+        if not subscribers:
+            del self._subscribers[user_id]
+        if subscriber.sending is not None:
+            subscriber.sending.cancel()
+        self.connections -= 1
+
+    def publish(self, user_ids: Iterable[int], message: str):
+        self.notifications += 1
+        for user_id in user_ids:
+            for subscriber in self._subscribers.get(user_id, ()):
+                subscriber.push(message)
+
+    def stats(self) -> dict:
+        return {
+            "listening": self.listening,
+            "connections": self.connections,
+            "users": len(self._subscribers),
+            "notifications": self.notifications,
+            "delivered": self.delivered,
+            "dropped": self.dropped,
+        }
+
+
+hub = Hub()
+
+
+async def notify(user_ids: Iterable[int], message: dict, db: AsyncSession):
+    # NOTIFY is transactional, the calling operation's commit is what sends it, a rollback drops it
+    user_ids = sorted(set(user_ids))
+    for first in range(0, len(user_ids), USER_IDS_PER_NOTIFY):
+        payload = orjson.dumps({"user_ids": user_ids[first:first + USER_IDS_PER_NOTIFY], "message": message})
+        await db.execute(select(func.pg_notify(CHANNEL, payload.decode())))
+
+
+def _on_notification(connection, pid, channel, payload):
+    notification = orjson.loads(payload)
+    if notification["message"].get("type") in BUSY_CHANGING_MESSAGES:
+        availability.busy_cache.invalidate(notification["user_ids"])
+    hub.publish(notification["user_ids"], orjson.dumps(notification["message"]).decode())
+
+
+async def run_listener():
+    # a dedicated connection outside the pool, it stays in LISTEN for the lifetime of the worker
+    while True:
+        connection = None
+        try:
+            connection = await asyncpg.connect(LISTEN_DSN)
+            await connection.add_listener(CHANNEL, _on_notification)
+            hub.listening = True
+            while True:
+                await asyncio.sleep(LISTENER_PING_SECONDS)
+                await connection.execute("SELECT 1")
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"Listening for calendar updates failed: {e}")
+        finally:
+            hub.listening = False
+            if connection is not None and not connection.is_closed():
+                await connection.close()
+        await asyncio.sleep(RECONNECT_SECONDS)
@@ -0,0 +1,123 @@
+import asyncio
+from datetime import datetime, timedelta
+
+from sqlalchemy import TIMESTAMP, delete, func, literal, literal_column, select
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+import models
+import recurrence
+from database import SessionLocal
+
+
+# occurrences are kept in db_event_occurrence from now - LOOKBACK up to now + HORIZON, the horizon job deletes
+# older ones and they're expanded on read
+HORIZON = timedelta(days=548)
+LOOKBACK = timedelta(days=366)
+REFRESH_INTERVAL = timedelta(hours=6)
+EVENTS_PER_BATCH = 500
+
+# end of the range every event is known to be materialized for, None until the first job run
+_materialized_until: datetime | None = None
+
+
+def materialized_until() -> datetime:
+    return _materialized_until or datetime.min
+
+
+def window() -> tuple[datetime, datetime]:
+    now = datetime.now()
+    return now - LOOKBACK, now + HORIZON
+
+
+def covers(start: datetime, end: datetime) -> bool:
+    # every write started at most LOOKBACK before its own time, so nothing after now - LOOKBACK is missing
+    return datetime.now() - LOOKBACK <= start and end <= materialized_until()
+
+
+def overlapping(start: datetime, end: datetime):
+    # must stay the same expression as idx_event_occurrence_period, '[]' is inlined for that reason
+    inclusive = literal_column("'[]'")
+    period = func.tsrange(models.DBEventOccurrence.occurrence_start, models.DBEventOccurrence.occurrence_end, inclusive)
+    return period.op("&&")(func.tsrange(literal(start, TIMESTAMP), literal(end, TIMESTAMP), inclusive))
+
+
+def build_rows(event, from_index: int, since: datetime, until: datetime) -> list[dict]:
+    if not recurrence.is_recurring(event):
+        indexes = [0] if from_index == 0 and event.event_date_end >= since else []
+    else:
+        indexes = []
+        index = max(from_index, recurrence.first_index_ending_after(event, since))
+        while recurrence.shift_date(event.event_date_start, event.recurrence, index) <= until:
+            indexes.append(index)
+            index += 1
+    return [
+        {
+            "event_id": event.event_id,
+            "occurrence_index": index,
+            "occurrence_start": recurrence.shift_date(event.event_date_start, event.recurrence, index),
+            "occurrence_end": recurrence.shift_date(event.event_date_end, event.recurrence, index),
+        }
+        for index in indexes
+    ]
+
+
+async def insert_rows(rows: list[dict], db: AsyncSession):
+    # every worker runs the horizon job and a rematerialize may run beside it, the first to insert an index wins
+    if rows:
+        await db.execute(insert(models.DBEventOccurrence).on_conflict_do_nothing(), rows)
+
+
+async def materialize_event(event, db: AsyncSession, from_index: int = 0):
+    await insert_rows(build_rows(event, from_index, *window()), db)
+
+
+async def clear_event(event_id: int, db: AsyncSession):
+    await db.execute(delete(models.DBEventOccurrence).where(models.DBEventOccurrence.event_id == event_id))
+
+
+async def rematerialize_event(event, db: AsyncSession):
+    await clear_event(event.event_id, db)
+    await materialize_event(event, db)
+
+
+async def extend_horizon(db: AsyncSession):
+    global _materialized_until
+    since, until = window()
+    last_event_id = 0
+    while True:
+        events = (await db.execute(
+            select(models.DBEvent)
+            .where(models.DBEvent.event_id > last_event_id)
+            .order_by(models.DBEvent.event_id)
+            .limit(EVENTS_PER_BATCH))).scalars().all()
+        if not events:
+            break
+        event_ids = [event.event_id for event in events]
+        # the window rolls, occurrences that ended before it are only ever expanded in closed form again
+        await db.execute(delete(models.DBEventOccurrence).where(
+            models.DBEventOccurrence.event_id.in_(event_ids), models.DBEventOccurrence.occurrence_end < since))
+        # aggregated over the batch only, through the primary key
+        materialized = dict((await db.execute(
+            select(models.DBEventOccurrence.event_id, func.max(models.DBEventOccurrence.occurrence_index))
+            .where(models.DBEventOccurrence.event_id.in_(event_ids))
+            .group_by(models.DBEventOccurrence.event_id))).all())
+        rows = []
+        for event in events:
+            last_index = materialized.get(event.event_id)
+            rows.extend(build_rows(event, 0 if last_index is None else last_index + 1, since, until))
+        await insert_rows(rows, db)
+        await db.commit()
+        last_event_id = events[-1].event_id
+        db.expunge_all()
+    _materialized_until = until
+
+
+async def run_horizon_job():
+    while True:
+        try:
+            async with SessionLocal() as db:
+                await extend_horizon(db)
+        except Exception as e:
+            print(f"Extending event occurrences failed: {e}")
+        await asyncio.sleep(REFRESH_INTERVAL.total_seconds())
@@ -0,0 +1,37 @@
+from fastapi import Query, Response
+from fastapi.responses import StreamingResponse
+
+from database import SessionLocal
+
+
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+# rows fetched per round trip from the server-side cursor in streaming mode
+STREAM_BATCH_SIZE = 500
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+
+# cursor is the key of the last row of the previous page, e.g. "42" or "7,42" for composite keys
+CursorQuery = Query(None, pattern=r"^\d+(,\d+)*$")
+LimitQuery = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE)
+
+
+def decode_cursor(cursor: str | None) -> tuple[int, ...] | None:
+    if cursor is None:
+        return None
+    return tuple(int(part) for part in cursor.split(","))
+
+
+def set_next_cursor(response: Response, page: list, limit: int, key):
+    # a short page is the last one, so no cursor
+    if len(page) == limit:
+        response.headers[NEXT_CURSOR_HEADER] = ",".join(str(value) for value in key(page[-1]))
+
+
+def ndjson_response(stream_rows, schema) -> StreamingResponse:
+    # the request's session is closed before a streaming body is sent, so the stream opens its own
+    async def lines():
+        async with SessionLocal() as db:
+            async for row in stream_rows(db):
+                yield schema.model_validate(row).model_dump_json() + "\n"
+
+    return StreamingResponse(lines(), media_type="application/x-ndjson")
@@ -0,0 +1,85 @@
+import asyncio
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import bcrypt
+from dotenv import load_dotenv
+
+
+load_dotenv()
+
+# bcrypt releases the GIL, so a thread pool is enough to keep hashing off the event loop
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", os.cpu_count() or 1))
+BCRYPT_ROUNDS = 8
+
+_executor = ThreadPoolExecutor(max_workers=PASSWORD_HASH_WORKERS, thread_name_prefix="bcrypt")
+# caps hashes in flight, everything above waits here instead of piling up inside the executor
+_slots = asyncio.Semaphore(PASSWORD_HASH_WORKERS)
+
+
+class PasswordPoolStats:
+    def __init__(self):
+        self.queued = 0
+        self.in_flight = 0
+        self.completed = 0
+        self.queue_wait_seconds_total = 0.0
+        self.queue_wait_seconds_max = 0.0
+
+
+password_pool_stats = PasswordPoolStats()
+
+
+async def _run(func, *args):
+    stats = password_pool_stats
+    started = time.perf_counter()
+    stats.queued += 1
+    try:
+        await _slots.acquire()
+    finally:
+        stats.queued -= 1
+    waited = time.perf_counter() - started
+    stats.queue_wait_seconds_total += waited
+    stats.queue_wait_seconds_max = max(stats.queue_wait_seconds_max, waited)
+    stats.in_flight += 1
+    try:
+        return await asyncio.get_running_loop().run_in_executor(_executor, func, *args)
+    finally:
+        stats.in_flight -= 1
+        stats.completed += 1
+        _slots.release()
+
+
+def _hash(password: str) -> str:
+    return bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt(rounds=BCRYPT_ROUNDS)).decode('utf-8')
+
+
+def _verify(password: str, password_hash: str) -> bool:
+    try:
+        return bcrypt.checkpw(password.encode('utf-8'), password_hash.encode('utf-8'))
+    except ValueError:
+        # not a bcrypt hash (e.g. seeded test users)
+        return False
+
+
+async def hash_password(password: str) -> str:
+    return await _run(_hash, password)
+
+
+async def verify_password(password: str, password_hash: str) -> bool:
+    return await _run(_verify, password, password_hash)
+
+
+def password_stats() -> dict:
+    return {
+        "workers": PASSWORD_HASH_WORKERS,
+        "queued": password_pool_stats.queued,
+        "in_flight": password_pool_stats.in_flight,
+        "completed": password_pool_stats.completed,
+        "queue_wait_seconds_total": password_pool_stats.queue_wait_seconds_total,
+        "queue_wait_seconds_max": password_pool_stats.queue_wait_seconds_max,
+    }
+
+
+def shutdown():
+    _executor.shutdown(wait=True, cancel_futures=True)
@@ -0,0 +1,99 @@
+import calendar
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import Iterable, Iterator
+
+
+FIXED_STEPS = {
+    "daily": timedelta(days=1),
+    "weekly": timedelta(weeks=1),
+}
+MONTH_STEPS = {
+    "monthly": 1,
+    "yearly": 12,
+}
+
+
+@dataclass(slots=True, frozen=True)
+class Occurrence:
+    event_id: int
+    created_by: int
+    event_name: str
+    event_description: str | None
+    event_date_start: datetime
+    event_date_end: datetime
+    event_location: str | None
+    privacy: str
+    recurrence: str | None
+    next_event_date: datetime | None
+
+
+def add_months(date: datetime, months: int) -> datetime:
+    # always counted from the series anchor, so the 31st becomes the 30th (or 28th) and comes back later
+    month_index = date.month - 1 + months
+    year = date.year + month_index // 12
+    month = month_index % 12 + 1
+    day = min(date.day, calendar.monthrange(year, month)[1])
+    return date.replace(year=year, month=month, day=day)
+
+
+def shift_date(date: datetime | None, recurrence: str, index: int) -> datetime | None:
+    if date is None or index == 0:
+        return date
+    if recurrence in FIXED_STEPS:
+        return date + FIXED_STEPS[recurrence] * index
+    return add_months(date, MONTH_STEPS[recurrence] * index)
+
+
+def is_recurring(event) -> bool:
+    return event.recurrence in FIXED_STEPS or event.recurrence in MONTH_STEPS
+
+
+def occurrence(event, index: int = 0) -> Occurrence:
+    recurrence = event.recurrence
+    return Occurrence(
+        event_id=event.event_id,
+        created_by=event.created_by,
+        event_name=event.event_name,
+        event_description=event.event_description,
+        event_date_start=shift_date(event.event_date_start, recurrence, index),
+        event_date_end=shift_date(event.event_date_end, recurrence, index),
+        event_location=event.event_location,
+        privacy=event.privacy,
+        recurrence=recurrence,
+        next_event_date=shift_date(event.next_event_date, recurrence, index),
+    )
+
+
+def first_index_ending_after(event, start: datetime) -> int:
+    # index of the first occurrence with event_date_end >= start
+    series_end = event.event_date_end
+    if series_end >= start:
+        return 0
+    if event.recurrence in FIXED_STEPS:
+        step = FIXED_STEPS[event.recurrence]
+        return -((series_end - start) // step)
+    months = MONTH_STEPS[event.recurrence]
+    months_apart = (start.year - series_end.year) * 12 + start.month - series_end.month
+    # estimate lands at most a step or two short because of day clamping, walk the rest
+    index = max(months_apart // months - 1, 0)
+    while add_months(series_end, months * index) < start:
+        index += 1
+    return index
+
+
+def iter_occurrence_indexes(event, start: datetime, end: datetime) -> Iterator[int]:
+    if not is_recurring(event):
+        if event.event_date_start <= end and event.event_date_end >= start:
+            yield 0
+        return
+    index = first_index_ending_after(event, start)
+    while shift_date(event.event_date_start, event.recurrence, index) <= end:
+        yield index
+        index += 1
+
+
+def expand(events: Iterable, start: datetime, end: datetime) -> Iterator[Occurrence]:
+    for event in events:
+        for index in iter_occurrence_indexes(event, start, end):
+            yield occurrence(event, index)
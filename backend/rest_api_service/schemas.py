@@ -69,3 +69,106 @@ class Token(BaseModel):
 
 class TokenData(BaseModel):
     username: str | None = None
+
+
+class UserSummarySchema(BaseModel):
+    user_id: int
+    username: str
+
+    class Config:
+        from_attributes = True
+
+
+class CategorySchema(BaseModel):
+    category_id: int
+    category_name: str | None
+    category_description: str | None
+
+    class Config:
+        from_attributes = True
+
+
+class EventParticipantSummarySchema(BaseModel):
+    user_id: int
+    participant_status: str
+    participant_role: str
+
+    class Config:
+        from_attributes = True
+
+
+class EventParticipantSchema(BaseModel):
+    event_id: int
+    user_id: int
+    participant_status: str
+    participant_role: str
+    response_time: datetime
+
+    class Config:
+        from_attributes = True
+
+
+class EventSchema(BaseModel):
+    event_id: int
+    created_by: int
+    event_name: str
+    event_description: str | None
+    event_date_start: datetime
+    event_date_end: datetime
+    event_location: str | None
+    privacy: str
+    recurrence: str
+    next_event_date: datetime | None
+    creator: UserSummarySchema
+    categories: list[CategorySchema]
+    participants: list[EventParticipantSummarySchema]
+
+    class Config:
+        from_attributes = True
+
+
+class EventSyncSchema(BaseModel):
+    # cursor goes into the next call, has_more asks for it right away
+    cursor: int
+    has_more: bool
+    events: list[EventSchema]
+    deleted: list[int]
+
+
+class EventOccurrenceSchema(BaseModel):
+    event_id: int
+    created_by: int
+    event_name: str
+    event_description: str | None
+    event_date_start: datetime
+    event_date_end: datetime
+    event_location: str | None
+    privacy: str
+    recurrence: str | None
+    next_event_date: datetime | None
+
+    class Config:
+        from_attributes = True
+
+
+class TimeSlotSchema(BaseModel):
+    start: datetime
+    end: datetime
+
+
+class FriendSuggestionSchema(BaseModel):
+    user: UserSummarySchema
+    mutual_friends: int
+    shared_events: int
+
+
+class ImportErrorSchema(BaseModel):
+    row: int
+    message: str
+
+
+class ImportReportSchema(BaseModel):
+    imported: int
+    failed: int
+    errors: list[ImportErrorSchema]
+    errors_truncated: bool
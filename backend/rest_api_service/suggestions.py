@@ -0,0 +1,25 @@
+import heapq
+from collections import Counter
+
+
+DEFAULT_SUGGESTIONS = 20
+MAX_SUGGESTIONS = 100
+# friend-of-friend edges read per request, bounds the work for users with very popular friends
+MAX_TWO_HOP_EDGES = 50000
+# the same bound for shared events, the newest events of the user and a sample of every event's participants
+MAX_SHARED_EVENTS = 200
+MAX_PARTICIPANTS_PER_SHARED_EVENT = 250
+MUTUAL_FRIEND_WEIGHT = 2
+SHARED_EVENT_WEIGHT = 1
+
+
+def score(mutual_friends: int, shared_events: int) -> int:
+    return mutual_friends * MUTUAL_FRIEND_WEIGHT + shared_events * SHARED_EVENT_WEIGHT
+
+
+def rank(mutual_friends: Counter, shared_events: Counter, limit: int) -> list[tuple[int, int, int]]:
+    # (user_id, mutual friends, shared events), best first, ties go to the lower user_id
+    candidates = mutual_friends.keys() | shared_events.keys()
+    best = heapq.nsmallest(limit, candidates, key=lambda user_id: (
+        -score(mutual_friends[user_id], shared_events[user_id]), -mutual_friends[user_id], user_id))
+    return [(user_id, mutual_friends[user_id], shared_events[user_id]) for user_id in best]
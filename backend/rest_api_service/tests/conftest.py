@@ -0,0 +1,143 @@
+import os
+import sys
+import uuid
+from datetime import date, datetime, timedelta
+
+import pytest
+
+SERVICE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, SERVICE_DIR)
+# database.py reads ../config.ini relative to the working directory
+os.chdir(SERVICE_DIR)
+
+from httpx import ASGITransport, AsyncClient
+from sqlalchemy import delete
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
+from sqlalchemy.pool import NullPool
+
+import main
+import models
+
+
+# a database set up like production: init.sql, then alembic upgrade head, tests roll back everything they write
+TEST_DATABASE_URL = os.getenv("TEST_DATABASE_URL")
+RUN_BENCHMARKS = bool(os.getenv("RUN_BENCHMARKS"))
+BENCHMARK_POOL_SIZE = 20
+BENCHMARK_EVENTS = 50
+
+
+@pytest.fixture
+def anyio_backend():
+    return "asyncio"
+
+
+@pytest.fixture
+async def engine():
+    if not TEST_DATABASE_URL:
+        pytest.skip("TEST_DATABASE_URL is not set")
+    engine = create_async_engine(make_url(TEST_DATABASE_URL).set(drivername="postgresql+asyncpg"),
+                                 poolclass=NullPool)
+    yield engine
+    await engine.dispose()
+
+
+@pytest.fixture
+async def db(engine):
+    # commits in crud only release a savepoint, the outer transaction is rolled back at the end
+    async with engine.connect() as connection:
+        transaction = await connection.begin()
+        session = AsyncSession(bind=connection, join_transaction_mode="create_savepoint", autoflush=False,
+                               expire_on_commit=False)
+        yield session
+        await session.close()
+        await transaction.rollback()
+
+
+@pytest.fixture
+async def client(db):
+    async def get_test_db():
+        yield db
+
+    main.app.dependency_overrides[main.get_db] = get_test_db
+    # ASGITransport doesn't run the lifespan, so the background jobs stay off
+    async with AsyncClient(transport=ASGITransport(app=main.app), base_url="http://test") as client:
+        yield client
+    main.app.dependency_overrides.clear()
+
+
+@pytest.fixture
+async def pooled_engine():
+    if not TEST_DATABASE_URL:
+        pytest.skip("TEST_DATABASE_URL is not set")
+    engine = create_async_engine(make_url(TEST_DATABASE_URL).set(drivername="postgresql+asyncpg"),
+                                 pool_size=BENCHMARK_POOL_SIZE, max_overflow=0)
+    yield engine
+    await engine.dispose()
+
+
+@pytest.fixture
+async def pooled_client(pooled_engine):
+    # concurrent requests need a session each, the way get_db hands them out in production
+    sessions = async_sessionmaker(pooled_engine, autoflush=False, expire_on_commit=False)
+
+    async def get_pooled_db():
+        async with sessions() as db:
+            yield db
+
+    main.app.dependency_overrides[main.get_db] = get_pooled_db
+    async with AsyncClient(transport=ASGITransport(app=main.app), base_url="http://test") as client:
+        yield client
+    main.app.dependency_overrides.clear()
+
+
+@pytest.fixture
+async def committed_user(pooled_engine):
+    # other sessions only see committed rows, so this data is deleted at the end instead of rolled back
+    async with AsyncSession(pooled_engine, expire_on_commit=False) as db:
+        user = await create_user(db)
+        friends = [await create_user(db) for _ in range(3)]
+        categories = [models.DBCategory(None, f"benchmark category {index} {user.user_id}", None)
+                      for index in range(2)]
+        db.add_all(categories)
+        await db.flush()
+        events = await create_events(db, user, BENCHMARK_EVENTS, categories, friends)
+        await db.commit()
+    yield user
+    event_ids = [event.event_id for event in events]
+    user_ids = [user.user_id, *(friend.user_id for friend in friends)]
+    async with AsyncSession(pooled_engine) as db:
+        await db.execute(delete(models.DBEventParticipants).where(models.DBEventParticipants.event_id.in_(event_ids)))
+        await db.execute(delete(models.DBEventCategory).where(models.DBEventCategory.event_id.in_(event_ids)))
+        await db.execute(delete(models.DBEvent).where(models.DBEvent.event_id.in_(event_ids)))
+        await db.execute(delete(models.DBCategory).where(
+            models.DBCategory.category_id.in_([category.category_id for category in categories])))
+        await db.execute(delete(models.DBUser).where(models.DBUser.user_id.in_(user_ids)))
+        await db.commit()
+
+
+async def create_user(db: AsyncSession) -> models.DBUser:
+    name = uuid.uuid4().hex[:12]
+    now = datetime.now()
+    user = models.DBUser(username=f"test_{name}", email=f"{name}@test.local", password_hash="-",
+                         birthday=date(2000, 1, 1), created_at=now, last_login=now, update_date=now, is_active=True)
+    db.add(user)
+    await db.flush()
+    return user
+
+
+async def create_events(db: AsyncSession, user: models.DBUser, count: int, categories: list[models.DBCategory],
+                        participants: list[models.DBUser]) -> list[models.DBEvent]:
+    start = datetime.now().replace(microsecond=0)
+    events = [models.DBEvent(None, user.user_id, f"event {index}", None, start + timedelta(days=index),
+                             start + timedelta(days=index, hours=1), None, "public", "weekly", None)
+              for index in range(count)]
+    for event in events:
+        event.categories = list(categories)
+    db.add_all(events)
+    await db.flush()
+    db.add_all(models.DBEventParticipants(event.event_id, participant.user_id, "accepted",
+                                          "host" if participant is user else "member", start)
+               for event in events for participant in [user, *participants])
+    await db.flush()
+    return events
@@ -0,0 +1,87 @@
+import asyncio
+import time
+
+import pytest
+from fastapi import FastAPI, Request
+from httpx import ASGITransport, AsyncClient
+from sqlalchemy import create_engine
+from sqlalchemy.engine import make_url
+from sqlalchemy.orm import sessionmaker
+
+import crud
+import models
+import pagination
+from conftest import BENCHMARK_EVENTS, BENCHMARK_POOL_SIZE, RUN_BENCHMARKS, TEST_DATABASE_URL
+from schemas import EventSchema
+
+
+REQUESTS = 200
+CONCURRENCY = [1, 10, 50]
+
+pytestmark = [pytest.mark.anyio, pytest.mark.skipif(not RUN_BENCHMARKS, reason="RUN_BENCHMARKS is not set")]
+
+# /events/get_user_events as it was before the port to AsyncSession: a synchronous psycopg2 session inside an
+# async def handler, every query holds the event loop until postgres answers
+blocking_app = FastAPI()
+
+
+@blocking_app.get("/events/get_user_events", response_model=list[EventSchema])
+async def blocking_get_user_events(user_id: int, request: Request):
+    with request.app.state.sessions() as db:
+        return db.execute(crud.events_of_user_query(user_id).order_by(models.DBEvent.event_id)
+                          .limit(pagination.DEFAULT_PAGE_SIZE)).scalars().all()
+
+
+@pytest.fixture
+def blocking_client():
+    engine = create_engine(make_url(TEST_DATABASE_URL).set(drivername="postgresql+psycopg2"),
+                           pool_size=BENCHMARK_POOL_SIZE, max_overflow=0)
+    blocking_app.state.sessions = sessionmaker(engine, autoflush=False, expire_on_commit=False)
+    yield AsyncClient(transport=ASGITransport(app=blocking_app), base_url="http://test")
+    engine.dispose()
+
+
+class LoopStall:
+    # how late a 1 ms timer fires while requests run, a blocked loop shows up as a long stall
+    def __init__(self):
+        self.max_seconds = 0.0
+        self._task = None
+
+    async def _tick(self):
+        while True:
+            started = time.perf_counter()
+            await asyncio.sleep(0.001)
+            self.max_seconds = max(self.max_seconds, time.perf_counter() - started - 0.001)
+
+    def __enter__(self):
+        self._task = asyncio.create_task(self._tick())
+        return self
+
+    def __exit__(self, *exc_info):
+        self._task.cancel()
+
+
+async def run(client: AsyncClient, user_id: int, concurrency: int) -> tuple[float, float]:
+    slots = asyncio.Semaphore(concurrency)
+
+    async def call():
+        async with slots:
+            response = await client.get("/events/get_user_events", params={"user_id": user_id})
+            assert response.status_code == 200, response.text
+            assert len(response.json()) == BENCHMARK_EVENTS
+
+    with LoopStall() as stall:
+        started = time.perf_counter()
+        await asyncio.gather(*(call() for _ in range(REQUESTS)))
+        seconds = time.perf_counter() - started
+    return REQUESTS / seconds, stall.max_seconds
+
+
+async def test_benchmark_concurrent_user_events(committed_user, pooled_client, blocking_client):
+    print(f"\n{REQUESTS} calls of /events/get_user_events, {BENCHMARK_EVENTS} events each")
+    print("concurrency | blocking psycopg2 req/s, max loop stall | AsyncSession req/s, max loop stall")
+    for concurrency in CONCURRENCY:
+        blocking_rate, blocking_stall = await run(blocking_client, committed_user.user_id, concurrency)
+        async_rate, async_stall = await run(pooled_client, committed_user.user_id, concurrency)
+        print(f"{concurrency:>11} | {blocking_rate:>7.0f} req/s, {blocking_stall * 1000:>6.1f} ms"
+              f" | {async_rate:>7.0f} req/s, {async_stall * 1000:>6.1f} ms")
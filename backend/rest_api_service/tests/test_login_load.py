@@ -0,0 +1,89 @@
+import asyncio
+import statistics
+import time
+
+import pytest
+from httpx import AsyncClient
+from sqlalchemy import update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+import models
+import passwords
+from conftest import RUN_BENCHMARKS
+
+
+PASSWORD = "benchmark password"
+READS = 200
+READ_CONCURRENCY = 5
+LOGIN_CONCURRENCY = 20
+
+pytestmark = [pytest.mark.anyio, pytest.mark.skipif(not RUN_BENCHMARKS, reason="RUN_BENCHMARKS is not set")]
+
+
+@pytest.fixture
+async def login_user(committed_user, pooled_engine):
+    async with AsyncSession(pooled_engine) as db:
+        await db.execute(update(models.DBUser).where(models.DBUser.user_id == committed_user.user_id)
+                         .values(password_hash=passwords._hash(PASSWORD)))
+        await db.commit()
+    return committed_user
+
+
+async def inline_verify_password(password: str, password_hash: str) -> bool:
+    # verify_password before the thread pool: bcrypt.checkpw straight on the event loop
+    return passwords._verify(password, password_hash)
+
+
+async def read_latencies(client: AsyncClient, user_id: int) -> list[float]:
+    slots = asyncio.Semaphore(READ_CONCURRENCY)
+    latencies = []
+
+    async def read():
+        async with slots:
+            started = time.perf_counter()
+            response = await client.get("/events/get_user_events", params={"user_id": user_id})
+            latencies.append(time.perf_counter() - started)
+            assert response.status_code == 200, response.text
+
+    await asyncio.gather(*(read() for _ in range(READS)))
+    return latencies
+
+
+async def read_latencies_during_logins(client: AsyncClient, user: models.DBUser) -> list[float]:
+    async def log_in_forever():
+        while True:
+            response = await client.post("/login", json={"username": user.username, "password_hash": PASSWORD})
+            assert response.status_code == 200, response.text
+
+    logins = [asyncio.create_task(log_in_forever()) for _ in range(LOGIN_CONCURRENCY)]
+    try:
+        await asyncio.sleep(0.1)
+        return await read_latencies(client, user.user_id)
+    finally:
+        for login in logins:
+            login.cancel()
+        await asyncio.gather(*logins, return_exceptions=True)
+
+
+def percentiles(latencies: list[float]) -> tuple[float, float]:
+    cuts = statistics.quantiles(latencies, n=20)
+    return cuts[9] * 1000, cuts[18] * 1000
+
+
+async def measure(client: AsyncClient, user: models.DBUser) -> tuple[tuple[float, float], tuple[float, float]]:
+    quiet = percentiles(await read_latencies(client, user.user_id))
+    loaded = percentiles(await read_latencies_during_logins(client, user))
+    return quiet, loaded
+
+
+async def test_read_latency_under_login_load(login_user, pooled_client, monkeypatch):
+    pooled = await measure(pooled_client, login_user)
+    with monkeypatch.context() as patch:
+        patch.setattr(passwords, "verify_password", inline_verify_password)
+        inline = await measure(pooled_client, login_user)
+
+    print(f"\n/events/get_user_events p50 / p95 in ms, {LOGIN_CONCURRENCY} concurrent logins, "
+          f"bcrypt rounds {passwords.BCRYPT_ROUNDS}, {passwords.PASSWORD_HASH_WORKERS} hash workers")
+    for name, (quiet, loaded) in (("inline bcrypt", inline), ("bcrypt thread pool", pooled)):
+        print(f"{name:>18} | no logins {quiet[0]:>6.1f} / {quiet[1]:>6.1f} | logins {loaded[0]:>6.1f} / {loaded[1]:>6.1f}")
+    assert pooled[1][1] < inline[1][1]
@@ -0,0 +1,57 @@
+import importlib.util
+import os
+import re
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import insert, select, text
+from sqlalchemy.dialects import postgresql
+
+import models
+import occurrences
+from conftest import SERVICE_DIR, create_events, create_user
+
+
+INDEX_NAME = "idx_event_occurrence_period"
+
+
+def load_migration(filename: str):
+    path = os.path.join(SERVICE_DIR, "migrations", "versions", filename)
+    spec = importlib.util.spec_from_file_location(filename.removesuffix(".py"), path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def normalize(sql: str) -> str:
+    return re.sub(r"\s+", "", sql.replace("db_event_occurrence.", ""))
+
+
+def test_overlap_expression_matches_index_expression():
+    # the planner only uses an expression index for the exact same expression
+    period = occurrences.overlapping(datetime(2024, 1, 1), datetime(2024, 2, 1)).left
+    query_expression = str(period.compile(dialect=postgresql.dialect(), compile_kwargs={"literal_binds": True}))
+    index_ddl = next(statement for statement in load_migration("0001_add_lookup_indexes.py").OCCURRENCE_DDL
+                     if INDEX_NAME in statement)
+    assert normalize(query_expression) in normalize(index_ddl)
+
+
+@pytest.mark.anyio
+async def test_range_query_uses_period_index(db):
+    user = await create_user(db)
+    events = await create_events(db, user, 20, [], [])
+    start = datetime(2020, 1, 1)
+    await db.execute(insert(models.DBEventOccurrence), [
+        {"event_id": event.event_id, "occurrence_index": index,
+         "occurrence_start": start + timedelta(days=index), "occurrence_end": start + timedelta(days=index, hours=1)}
+        for event in events for index in range(500)])
+    await db.execute(text("ANALYZE db_event_occurrence"))
+    # the table is small, without this the planner may prefer a sequential scan even with a usable index
+    await db.execute(text("SET LOCAL enable_seqscan = off"))
+
+    window_start = start + timedelta(days=100)
+    statement = select(models.DBEventOccurrence.event_id).where(
+        occurrences.overlapping(window_start, window_start + timedelta(days=7)))
+    compiled = statement.compile(dialect=postgresql.dialect(), compile_kwargs={"literal_binds": True})
+    plan = "\n".join((await db.execute(text(f"EXPLAIN {compiled}"))).scalars().all())
+    assert INDEX_NAME in plan, plan
@@ -0,0 +1,63 @@
+import pytest
+from sqlalchemy import event
+
+import models
+from conftest import create_events, create_user
+
+
+# statements a list endpoint may issue however many events it returns, anything above is an N+1
+MAX_STATEMENTS_PER_LIST_REQUEST = 6
+
+LIST_ENDPOINTS = ["/events/get_user_events", "/event/crated_by"]
+
+pytestmark = pytest.mark.anyio
+
+
+class StatementCounter:
+    def __init__(self, engine):
+        self.engine = engine
+        self.statements = 0
+
+    def __enter__(self):
+        event.listen(self.engine.sync_engine, "before_cursor_execute", self._count)
+        return self
+
+    def __exit__(self, *exc_info):
+        event.remove(self.engine.sync_engine, "before_cursor_execute", self._count)
+
+    def _count(self, *args):
+        self.statements += 1
+
+
+async def count_statements(engine, client, path: str, params: dict) -> tuple[int, list]:
+    with StatementCounter(engine) as counter:
+        response = await client.get(path, params=params)
+    assert response.status_code == 200, response.text
+    return counter.statements, response.json()
+
+
+@pytest.mark.parametrize("path", LIST_ENDPOINTS)
+async def test_list_endpoint_statement_count_does_not_grow_with_events(engine, db, client, path):
+    user = await create_user(db)
+    friends = [await create_user(db) for _ in range(3)]
+    categories = [models.DBCategory(None, f"test category {index} {user.user_id}", None) for index in range(2)]
+    db.add_all(categories)
+    await db.flush()
+
+    user_id = user.user_id
+
+    # the request shares this session, so empty the identity map or the collections loaded while seeding
+    # answer from memory and hide a missing selectinload
+    await create_events(db, user, 2, categories, friends)
+    db.expunge_all()
+    few, body = await count_statements(engine, client, path, {"user_id": user_id})
+    assert len(body) == 2
+
+    await create_events(db, user, 20, categories, friends)
+    db.expunge_all()
+    many, body = await count_statements(engine, client, path, {"user_id": user_id})
+    assert len(body) == 22
+    assert all(len(event["categories"]) == 2 and len(event["participants"]) == 4 for event in body)
+
+    assert many == few
+    assert many <= MAX_STATEMENTS_PER_LIST_REQUEST
@@ -0,0 +1,59 @@
+import calendar
+import random
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+import pytest
+
+import recurrence
+
+
+SERIES = 3000
+RECURRENCES = [*recurrence.FIXED_STEPS, *recurrence.MONTH_STEPS]
+
+
+def random_series(rng: random.Random, event_id: int):
+    start = datetime(2000, 1, 1) + timedelta(minutes=rng.randrange(25 * 365 * 24 * 60))
+    # 29th-31st are picked often, they're where month clamping matters
+    if rng.random() < 0.3:
+        start = start.replace(day=min(rng.choice([28, 29, 30, 31]), calendar.monthrange(start.year, start.month)[1]))
+    end = start + timedelta(minutes=rng.randrange(3 * 24 * 60))
+    return SimpleNamespace(event_id=event_id, created_by=1, event_name="series", event_description=None,
+                           event_date_start=start, event_date_end=end, event_location=None, privacy="private",
+                           recurrence=rng.choice(RECURRENCES), next_event_date=None)
+
+
+def brute_force_indexes(event, start: datetime, end: datetime) -> list[int]:
+    # every occurrence from the first one, the walk the closed form replaces
+    indexes = []
+    index = 0
+    while recurrence.shift_date(event.event_date_start, event.recurrence, index) <= end:
+        if recurrence.shift_date(event.event_date_end, event.recurrence, index) >= start:
+            indexes.append(index)
+        index += 1
+    return indexes
+
+
+def test_closed_form_matches_brute_force_walk():
+    rng = random.Random(4)
+    for event_id in range(SERIES):
+        event = random_series(rng, event_id)
+        window_start = event.event_date_start + timedelta(hours=rng.randrange(-24 * 30, 24 * 365 * 8))
+        window_end = window_start + timedelta(hours=rng.randrange(24 * 60))
+        expected = brute_force_indexes(event, window_start, window_end)
+        assert list(recurrence.iter_occurrence_indexes(event, window_start, window_end)) == expected, event
+        assert [(occurrence.event_date_start, occurrence.event_date_end)
+                for occurrence in recurrence.expand([event], window_start, window_end)] == [
+            (recurrence.shift_date(event.event_date_start, event.recurrence, index),
+             recurrence.shift_date(event.event_date_end, event.recurrence, index)) for index in expected]
+
+
+@pytest.mark.parametrize("start, months, expected", [
+    (datetime(2024, 1, 31), 1, datetime(2024, 2, 29)),
+    (datetime(2023, 1, 31), 1, datetime(2023, 2, 28)),
+    (datetime(2024, 1, 31), 2, datetime(2024, 3, 31)),
+    (datetime(2024, 2, 29), 12, datetime(2025, 2, 28)),
+    (datetime(2024, 2, 29), 48, datetime(2028, 2, 29)),
+])
+def test_months_are_counted_from_the_anchor_and_clamped(start, months, expected):
+    assert recurrence.add_months(start, months) == expected
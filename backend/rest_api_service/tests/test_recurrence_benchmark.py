@@ -0,0 +1,80 @@
+import os
+import random
+import time
+from datetime import datetime, timedelta
+
+import pytest
+
+import models
+import recurrence
+
+
+# timings only mean something on a quiet machine, RUN_BENCHMARKS=1 python -m pytest -s tests/test_recurrence_benchmark.py
+pytestmark = pytest.mark.skipif(not os.getenv("RUN_BENCHMARKS"), reason="RUN_BENCHMARKS is not set")
+
+NOW = datetime(2026, 10, 18)
+WINDOW = (NOW, NOW + timedelta(days=7))
+SERIES = 10000
+# the step walk takes ~35us per step, it is timed on a sample and scaled to the whole set
+STEP_WALK_SAMPLE = 300
+
+
+def make_series(count: int, oldest: timedelta, rng: random.Random) -> list[models.DBEvent]:
+    # day <= 28 so the step walk below, which can't clamp month ends, runs on every series
+    series = []
+    for event_id in range(count):
+        start = (NOW - timedelta(minutes=rng.randrange(int(oldest.total_seconds() // 60)))).replace(
+            day=rng.randrange(1, 29), second=0, microsecond=0)
+        rule = rng.choice([*recurrence.FIXED_STEPS, *recurrence.MONTH_STEPS])
+        end = start + timedelta(hours=1)
+        series.append(models.DBEvent(event_id, 1, "series", None, start, end, None, "private", rule,
+                                     recurrence.shift_date(start, rule, 1)))
+    return series
+
+
+def step_walk(events, start: datetime, end: datetime) -> list:
+    # the expansion /events/range_of_time did before, one DBEvent copy per occurrence from the first one
+    found = []
+    for event in events:
+        while event is not None and event.event_date_start <= end:
+            if event.event_date_end >= start:
+                found.append(event)
+            event = event.next_event()
+    return found
+
+
+def timed(function, *args) -> tuple[float, list]:
+    started = time.perf_counter()
+    result = function(*args)
+    return time.perf_counter() - started, result
+
+
+def compare(name: str, series: list[models.DBEvent]):
+    closed_seconds, occurrences = timed(lambda: list(recurrence.expand(series, *WINDOW)))
+    sample = series[:STEP_WALK_SAMPLE]
+    walk_seconds, walked = timed(step_walk, sample, *WINDOW)
+    walk_seconds *= len(series) / len(sample)
+    sampled_ids = {event.event_id for event in sample}
+    assert sorted((event.event_id, event.event_date_start) for event in walked) == sorted(
+        (occurrence.event_id, occurrence.event_date_start) for occurrence in occurrences
+        if occurrence.event_id in sampled_ids)
+    print(f"\n{name}: {len(series)} series, {len(occurrences)} occurrences in the week, "
+          f"closed form {closed_seconds * 1000:.1f} ms, step walk ~{walk_seconds * 1000:.0f} ms "
+          f"({walk_seconds / closed_seconds:.0f}x)")
+    return closed_seconds, walk_seconds
+
+
+def test_benchmark_10k_series():
+    closed_seconds, walk_seconds = compare("10k series up to 2 years old",
+                                           make_series(SERIES, timedelta(days=730), random.Random(1)))
+    assert closed_seconds < walk_seconds
+
+
+def test_benchmark_multi_year_old_series():
+    # the closed form does the same work for a series started last week or five years ago
+    recent, _ = compare("series from the last week", make_series(1000, timedelta(days=7), random.Random(2)))
+    old, walk_seconds = compare("series 3-5 years old", [
+        event for event in make_series(3000, timedelta(days=5 * 365), random.Random(3))
+        if event.event_date_start < NOW - timedelta(days=3 * 365)][:1000])
+    assert old < walk_seconds
+    assert old < recent * 5
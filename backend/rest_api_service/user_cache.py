@@ -0,0 +1,68 @@
+import os
+import time
+from collections import OrderedDict
+
+from dotenv import load_dotenv
+
+from schemas import UserSchema
+
+
+load_dotenv()
+
+USER_CACHE_SIZE = int(os.getenv("USER_CACHE_SIZE", 10000))
+USER_CACHE_TTL_SECONDS = float(os.getenv("USER_CACHE_TTL_SECONDS", 60))
+
+
+class UserCache:
+    # per process, invalidation only reaches this worker so the ttl bounds staleness for the others
+    def __init__(self, max_size: int, ttl: float):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries: OrderedDict[str, tuple[float, UserSchema]] = OrderedDict()
+        self._subjects: dict[int, str] = {}
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, subject: str) -> UserSchema | None:
+        entry = self._entries.get(subject)
+        if entry is None or entry[0] < time.monotonic():
+            if entry is not None:
+                self._remove(subject, entry[1])
+            self.misses += 1
+            return None
+        self._entries.move_to_end(subject)
+        self.hits += 1
+        return entry[1]
+
+    def put(self, subject: str, user: UserSchema):
+        self._entries[subject] = (time.monotonic() + self.ttl, user)
+        self._entries.move_to_end(subject)
+        self._subjects[user.user_id] = subject
+        while len(self._entries) > self.max_size:
+            oldest, (_, evicted) = next(iter(self._entries.items()))
+            self._remove(oldest, evicted)
+            self.evictions += 1
+
+    def invalidate(self, user_id: int):
+        subject = self._subjects.pop(user_id, None)
+        if subject is not None:
+            self._entries.pop(subject, None)
+
+    def _remove(self, subject: str, user: UserSchema):
+        del self._entries[subject]
+        if self._subjects.get(user.user_id) == subject:
+            del self._subjects[user.user_id]
+
+    def stats(self) -> dict:
+        return {
+            "size": len(self._entries),
+            "max_size": self.max_size,
+            "ttl_seconds": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
+
+
+user_cache = UserCache(USER_CACHE_SIZE, USER_CACHE_TTL_SECONDS)
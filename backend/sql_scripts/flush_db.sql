@@ -2,6 +2,8 @@
 
 -- DELETE ALL DATA
 DELETE FROM db_event_participants;
+DELETE FROM db_event_occurrence;
+DELETE FROM db_event_change;
 DELETE FROM db_user_friendship;
 DELETE FROM db_event_category;
 DELETE FROM db_event;